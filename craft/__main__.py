@@ -15,4 +15,4 @@ if sys.argv[0].endswith("__main__.py"):
     del os
 
 if __name__=='__main__':
-	main()
+	sys.exit(main())
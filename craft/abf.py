@@ -9,13 +9,13 @@ def calc_abf(pval, maf, n, n_controls, n_cases):
         (Wakefield, 2009, Genet Epidemiol.)
         Based on Chris Wallace work
     Args:
-        pval (float): GWAS p-value
-        maf (float): Minor allele freq
-        n (int): Sample size
+        pval (float or array): GWAS p-value
+        maf (float or array): Minor allele freq
+        n (int or array): Sample size
         n_controls: Number of controls
         n_cases: Number of cases
     Returns:
-        ABF
+        ABF (a float for scalar input, an array for array input)
 
     **Usage**
     For a binary trait as no exact Bayes factor is calculable.
@@ -26,12 +26,12 @@ def calc_abf(pval, maf, n, n_controls, n_cases):
     Assumes single causal variant only.
     """
 
-    # Assert/set types
-    pval = float(pval)
-    maf = float(maf)
-    n = int(n)
-    n_controls = int(n_controls)
-    n_cases = int(n_cases)
+    # Assert/set types. Arrays are accepted so that every SNP of every locus
+    # can be calculated in one broadcast pass; counts are truncated as int() would.
+    pval = np.asarray(pval, dtype=float)
+    maf = np.asarray(maf, dtype=float)
+    n_controls = np.trunc(np.asarray(n_controls, dtype=float))
+    n_cases = np.trunc(np.asarray(n_cases, dtype=float))
 
     # Variant of ABF calculation that uses p-values
     # Calculate Z-score
@@ -70,27 +70,120 @@ def calc_postprob(data):
     This assumes there is 1 causal SNP in the region, and that the prior probability is that any SNP in the region is equally likely to be that causal SNP.
     """
     sum_ABF = data['ABF'].sum()
-    for index, row in data.iterrows():
-        data['pp'] = data['ABF'] / sum_ABF
+    data['pp'] = data['ABF'] / sum_ABF
     return data
 
+def calc_posteriors(ABF, locus):
+    """ Calculate posterior and cumulative posterior probabilities for many loci at once.
+
+    Args:
+        ABF (array): approximate Bayes factor of each SNP
+        locus (array): integer locus number (0, 1, 2...) of each SNP
+    Returns:
+        pp, cpp (arrays in input order) and order, the permutation that sorts
+        SNPs by locus, then by descending posterior probability.
+
+    Each locus is normalised by its own sum of ABFs (segment-wise sums), as in calc_postprob.
+    The cumulative posterior of a SNP is the sum of pp over the SNPs in its locus ranked at or above it.
+    """
+    ABF = np.asarray(ABF, dtype=float)
+    locus = np.asarray(locus)
+    sum_ABF = np.bincount(locus, weights=ABF)
+    pp = ABF / sum_ABF[locus]
+
+    # stable sort: by locus, then by descending pp
+    order = np.lexsort((-pp, locus))
+    cpp = np.empty_like(pp)
+    cpp[order] = pd.Series(pp[order]).groupby(locus[order]).cumsum().values
+    return pp, cpp, order
+
+def cred_level(cred_threshold):
+    """ Convert a credible set threshold to a proportion.
+
+    Accepts a percentage (e.g. '95', 99) or a proportion (e.g. 0.95).
+    """
+    level = float(cred_threshold)
+    if level > 1:
+        level = level / 100
+    return level
+
+def posteriors(loci, previous=None, reuse=()):
+    """ Calculate ABF, posterior and cumulative posterior probabilities for all loci at once.
+
+    loci is one concatenated dataframe of locus SNPs, keyed by index_rsid.
+    Returns it with ABF, pp and cpp columns added, sorted by locus (in order of
+    first appearance) and then by descending posterior probability.
+
+    If previous (an earlier result of posteriors) is given, the probabilities of the loci with an index_rsid
+    in reuse are taken from it instead; these loci must have the same SNPs, in the same order, as before
+    (see getSNPs.unchanged_loci).
+    """
+    locus, index_rsids = pd.factorize(loci['index_rsid'])
+    reused = np.zeros(len(loci), dtype=bool)
+    if previous is not None and len(reuse):
+        reused = loci['index_rsid'].astype(str).isin(reuse).values
+        old = previous[previous['index_rsid'].astype(str).isin(reuse)]
+        # previous rows, by locus in the order of loci, then in their original (row index) order
+        old_locus = pd.Index(index_rsids.astype(str)).get_indexer(old['index_rsid'].astype(str))
+        old = old.iloc[np.lexsort((old.index.values, old_locus))]
+        if len(old) != reused.sum():
+            reused[:] = False
+    ABF = np.empty(len(loci))
+    ABF[reused] = old['ABF'].values if reused.any() else []
+    new = ~reused
+    ABF[new] = calc_abf(pval=loci['pvalue'].values[new],
+                        maf=loci['maf'].values[new],
+                        n=loci['all_total'].values[new],
+                        n_controls=loci['controls_total'].values[new],
+                        n_cases=loci['cases_total'].values[new])
+    pp, cpp, order = calc_posteriors(ABF, locus)
+    if reused.any():
+        pp[reused] = old['pp'].values
+        cpp[reused] = old['cpp'].values
+        order = np.lexsort((-pp, locus))
+    loci = loci.assign(ABF=ABF, pp=pp, cpp=cpp)
+    return loci.iloc[order]
+
+def trim_credible(loci, cred_threshold):
+    """ Trim loci (as returned by posteriors) to their credible SNP sets in one grouped pass.
+
+    For each locus, SNPs are taken in order of descending posterior probability up to
+    and including the first SNP with a cumulative posterior probability >= threshold.
+    """
+    level = cred_level(cred_threshold)
+    locus, index_rsids = pd.factorize(loci['index_rsid'])
+    # rank of each SNP within its (contiguous) locus
+    starts = np.concatenate([[0], np.cumsum(np.bincount(locus))[:-1]])
+    rank = np.arange(len(loci)) - starts[locus]
+    # number of SNPs below the threshold in each locus; keep those plus one
+    count = np.bincount(locus, weights=(loci['cpp'].values < level))
+    return loci[rank <= count[locus]]
+
+def credible_sets(loci, cred_threshold):
+    """ Return the credible SNP sets of all loci, genome-wide.
+
+    loci is one concatenated dataframe of locus SNPs, keyed by index_rsid.
+    cred_threshold may be '95', '99' or any other percentage or proportion.
+    """
+    return trim_credible(posteriors(loci), cred_threshold)
+
 def abf(data_dfs, cred_threshold):
-    data_list = []
-    for data in data_dfs:
-        data['ABF'] = data.apply(
-            lambda row: calc_abf(pval=row['pvalue'],
-                                maf=row['maf'],
-                                n=row['all_total'],
-                                n_controls=row['controls_total'],
-                                n_cases=row['cases_total']), axis=1)
-        data = calc_postprob(data)
-        data = data.sort_values('pp', ascending=False)
-        data['cpp'] = data.pp.cumsum()
-    # Trim credible SNPs based on posterior probability threshold
-        if cred_threshold == '95':
-            count = sum(data.cpp < 0.95)
-        if cred_threshold =='99':
-            count = sum(data.cpp < 0.99)
-        data = data.head(count+1)
-        data_list.append(data)
+    """ Calculate ABF and posterior probabilities for each locus and return its credible SNP set.
+
+    The loci are concatenated and passed through credible_sets in one pass.
+    As before, ABF and pp columns are also added to each locus dataframe in data_dfs.
+    """
+    if not data_dfs:
+        return []
+    loci = posteriors(pd.concat(data_dfs, ignore_index=True))
+    cred = trim_credible(loci, cred_threshold)
+
+    # add ABF and pp to each locus dataframe in its original row order
+    loci = loci.sort_index()
+    bounds = np.cumsum([0] + [len(data) for data in data_dfs])
+    for i, data in enumerate(data_dfs):
+        data['ABF'] = loci['ABF'].values[bounds[i]:bounds[i+1]]
+        data['pp'] = loci['pp'].values[bounds[i]:bounds[i+1]]
+
+    data_list = [data for index_rsid, data in cred.groupby('index_rsid', sort=False, observed=True)]
     return data_list
@@ -0,0 +1,94 @@
+import os
+import glob
+import json
+import sqlite3
+import hashlib
+
+class AnnotationCache:
+    """ A persistent cache of ANNOVAR gene-based annotations, in an SQLite database.
+
+    Annotations are keyed by variant (chromosome, start, end, reference and observed allele),
+    ANNOVAR build version and database type, so the same variants are not re-annotated on
+    every rerun or across studies.
+
+    Each build version and database type has a version stamp made from the names, sizes and
+    modification times of its humandb files; when the files change, its cached annotations
+    are removed.
+    """
+    columns = ['var_effect', 'genes', 'exonic_variant_function', 'genes_transcriptID']
+
+    def __init__(self, db_file, humandb_dir):
+        self.db_file = db_file
+        self.humandb_dir = humandb_dir
+        self.hits = 0
+        self.misses = 0
+        self._checked = set()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS stamps (buildver TEXT, dbtype TEXT, stamp TEXT, PRIMARY KEY (buildver, dbtype))")
+            conn.execute("CREATE TABLE IF NOT EXISTS annotations ("
+                         "chromosome TEXT, start INTEGER, end INTEGER, ref TEXT, alt TEXT, buildver TEXT, dbtype TEXT, "
+                         "var_effect TEXT, genes TEXT, exonic_variant_function TEXT, genes_transcriptID TEXT, "
+                         "PRIMARY KEY (chromosome, start, end, ref, alt, buildver, dbtype))")
+
+    def _connect(self):
+        return sqlite3.connect(self.db_file, timeout=60)
+
+    def stamp(self, buildver, dbtype):
+        """ Return the version stamp of the humandb files for a build version and database type. """
+        files = sorted(glob.glob(os.path.join(self.humandb_dir, f"{buildver}_{dbtype}*")))
+        stamp = [[os.path.basename(f), os.path.getsize(f), os.stat(f).st_mtime_ns] for f in files]
+        return hashlib.sha256(json.dumps(stamp).encode()).hexdigest()
+
+    def _check(self, conn, buildver, dbtype):
+        """ Remove cached annotations made with different humandb files. """
+        if (buildver, dbtype) in self._checked:
+            return
+        stamp = self.stamp(buildver, dbtype)
+        row = conn.execute("SELECT stamp FROM stamps WHERE buildver = ? AND dbtype = ?", (buildver, dbtype)).fetchone()
+        if row is None or row[0] != stamp:
+            conn.execute("DELETE FROM annotations WHERE buildver = ? AND dbtype = ?", (buildver, dbtype))
+            conn.execute("INSERT OR REPLACE INTO stamps VALUES (?, ?, ?)", (buildver, dbtype, stamp))
+        self._checked.add((buildver, dbtype))
+
+    def get(self, variants, buildver, dbtype):
+        """ Look up a list of variants, each a (chromosome, start, end, ref, alt) tuple.
+
+        Returns a dict of variant -> (var_effect, genes, exonic_variant_function, genes_transcriptID)
+        for the cached variants.
+        """
+        variants = [self.key(variant) for variant in variants]
+        with self._connect() as conn:
+            self._check(conn, buildver, dbtype)
+            conn.execute("CREATE TEMP TABLE wanted (chromosome TEXT, start INTEGER, end INTEGER, ref TEXT, alt TEXT)")
+            conn.executemany("INSERT INTO wanted VALUES (?, ?, ?, ?, ?)", variants)
+            rows = conn.execute(
+                "SELECT a.chromosome, a.start, a.end, a.ref, a.alt, "
+                "a.var_effect, a.genes, a.exonic_variant_function, a.genes_transcriptID "
+                "FROM wanted w JOIN annotations a USING (chromosome, start, end, ref, alt) "
+                "WHERE a.buildver = ? AND a.dbtype = ?", (buildver, dbtype)).fetchall()
+            conn.execute("DROP TABLE wanted")
+        found = {tuple(row[:5]): tuple(row[5:]) for row in rows}
+        self.hits += len(found)
+        self.misses += len(set(variants)) - len(found)
+        return found
+
+    def put(self, annotations, buildver, dbtype):
+        """ Add annotations, a dict of variant -> (var_effect, genes, exonic_variant_function, genes_transcriptID). """
+        with self._connect() as conn:
+            self._check(conn, buildver, dbtype)
+            conn.executemany(
+                "INSERT OR REPLACE INTO annotations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [self.key(variant) + (buildver, dbtype) + tuple(annotation)
+                 for variant, annotation in annotations.items()])
+
+    def stats(self):
+        """ Return the cache statistics: hits and misses in this run, and entries. """
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM annotations").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    @staticmethod
+    def key(variant):
+        """ Return a variant as a (chromosome, start, end, ref, alt) tuple of the types stored in the cache. """
+        chromosome, start, end, ref, alt = variant
+        return (str(chromosome), int(start), int(end), str(ref), str(alt))
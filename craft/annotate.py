@@ -1,3 +1,4 @@
+import itertools
 import os
 import re
 import tempfile
@@ -5,8 +6,10 @@ import tempfile
 import vcf as pyvcf
 import pandas as pd
 
+import craft.annocache as annocache
 import craft.config as config
 import craft.read as read
+import craft.tools as tools
 
 def prepare_df_annoVar(df):
     """Prepare internal dataframe as input to ANNOVAR.
@@ -32,23 +35,85 @@ def prepare_df_annoVar(df):
 def annotation_annoVar(df):
     """Use ANNOVAR to annotate prepared internal dataframe.
 
-    Describe ANNOVAR functions here. """
-    with tempfile.TemporaryDirectory() tempdir as tempdir:
-        # make file in tempdir, write to file
-        to_annovar = os.path.join(tempdir, "to_annovar")
-        df.to_csv(to_annovar, sep='\t', index=False, header=False, float_format='%g')
-        # perform annotation with ANNOVAR (give input, standard output)
-        cmd = (f"{config.annovar_dir}/annotate_variation.pl -geneanno "
-           "-dbtype refGene -buildver hg19 "
-           f"{to_annovar} {config.annovar_dir}/humandb/")
-        os.system(cmd)
-        # Output files written to -.variant_function, -.exonic_variant_function
-        # add new columns and get original column names
-        colnames = ['var_effect','genes'] + list(df.columns)
-        # read back in my temp output files as a dataframe with column names
-        df = read.annovar(to_annovar + ".variant_function",
-        to_annovar + ".exonic_variant_function", colnames)
-    return df
+    See annotation_annoVar_batch. """
+    return annotation_annoVar_batch([df])[0]
+
+def annotation_annoVar_batch(dfs, cache=None, annotator=None):
+    """Use ANNOVAR to annotate a list of prepared internal dataframes in a single run.
+
+    annotate_variation.pl loads the whole refGene database every time it runs, so the dataframes (e.g. the
+    credible SNP sets of every locus of every input file) have their distinct variants annotated in one pass,
+    and the annotations are added back to each dataframe, in order. Each annotated dataframe has the columns
+    ANNOVAR adds (var_effect, genes and, where any of its SNPs are exonic, exonic_variant_function and
+    genes_transcriptID) and its own original columns; as with ANNOVAR's own output, SNPs it gives no
+    annotation for are left out.
+
+    If cache (an annocache.AnnotationCache) is given, only variants missing from the cache are sent to ANNOVAR.
+    If annotator (a refgene.RefGene) is given, variants are annotated in-process by it instead, without the cache.
+    """
+    if not dfs:
+        return []
+    buildver, dbtype = config.annovar_buildver, config.annovar_dbtype
+    frames = []
+    with tempfile.TemporaryDirectory() as tempdir:
+        # write each dataframe and read it back, so values are as ANNOVAR would write them to its output
+        for i, df in enumerate(dfs):
+            df_file = os.path.join(tempdir, f"input_{i}")
+            df.to_csv(df_file, sep='\t', index=False, header=False, float_format='%g')
+            frames.append(pd.read_csv(df_file, sep='\t', names=list(df.columns)) if len(df) else df.reset_index(drop=True))
+        # the first 5 columns are the variant: chromosome, start, end, reference and observed allele
+        variants = [[annocache.AnnotationCache.key(variant) for variant in zip(*(rows[col] for col in rows.columns[:5]))]
+                    for rows in frames]
+        unique = list(dict.fromkeys(itertools.chain.from_iterable(variants)))
+        if annotator:
+            cache = None
+        annotations = cache.get(unique, buildver, dbtype) if cache else {}
+        uncached = [variant for variant in unique if variant not in annotations]
+        if uncached and annotator:
+            annotations.update(annotator.annotate_variants(uncached))
+        elif uncached:
+            new = annotation_annoVar_variants(uncached, tempdir, buildver, dbtype)
+            annotations.update(new)
+            if cache:
+                cache.put(new, buildver, dbtype)
+    # add the annotation columns to each dataframe; as with ANNOVAR's own output, variants it did not annotate are left out
+    columns = annocache.AnnotationCache.columns
+    annotated_dfs = []
+    for rows, keys in zip(frames, variants):
+        found = [j for j, variant in enumerate(keys) if variant in annotations]
+        annotation_df = pd.DataFrame([annotations[keys[j]] for j in found], columns=columns)
+        annotated = pd.concat([annotation_df, rows.iloc[found].reset_index(drop=True)], axis=1)
+        df_columns = ['var_effect','genes'] + list(rows.columns)
+        if annotated.exonic_variant_function.notna().any():
+            df_columns += ['exonic_variant_function', 'genes_transcriptID']
+        annotated_dfs.append(annotated[df_columns])
+    return annotated_dfs
+
+def annotation_annoVar_variants(variants, tempdir, buildver, dbtype):
+    """Use ANNOVAR to annotate a list of distinct (chromosome, start, end, ref, alt) variants.
+
+    Returns a dict of variant -> (var_effect, genes, exonic_variant_function, genes_transcriptID);
+    the exonic columns are None for non-exonic variants.
+    """
+    # make file in tempdir, write to file; the last column numbers the variants
+    to_annovar = os.path.join(tempdir, "to_annovar")
+    variant_df = pd.DataFrame(variants, columns=['chromosome', 'start', 'end', 'ref', 'alt'])
+    variant_df['variant'] = range(len(variants))
+    variant_df.to_csv(to_annovar, sep='\t', index=False, header=False)
+    # perform annotation with ANNOVAR (give input, standard output)
+    cmd = [os.path.join(config.annovar_dir, "annotate_variation.pl"), "-geneanno", "-dbtype", dbtype, "-buildver", buildver,
+           to_annovar, os.path.join(config.annovar_dir, "humandb/")]
+    tools.run(cmd, "annovar")
+    # Output files written to -.variant_function, -.exonic_variant_function
+    colnames = ['var_effect','genes'] + list(variant_df.columns)
+    df = read.annovar(to_annovar + ".variant_function",
+    to_annovar + ".exonic_variant_function", colnames, on=['variant'])
+    if 'exonic_variant_function' not in df:
+        df['exonic_variant_function'] = None
+        df['genes_transcriptID'] = None
+    df = df.astype(object).where(df.notna(), None)
+    return {variants[row.variant]: (row.var_effect, row.genes, row.exonic_variant_function, row.genes_transcriptID)
+            for row in df.itertuples()}
 
 def finemap_annotation_annoVar(cred_snps, locus_df):
     """Use ANNOVAR to annotate prepared .cred FINEMAP output.
@@ -61,43 +126,31 @@ def finemap_annotation_annoVar(cred_snps, locus_df):
     This function:
     Filters the locus dataframe (containing all summary statistic
     information, including chromosome, position, allele 1, allele2),
-    using a list of rsids obtained from the .cred file.
-
-    Uses the prepare_df_annoVAR function from craft.annotate to process
-    the new dataframe as ANNOVAR input.
+    using a list of rsids obtained from the .cred file, and prepares it
+    as ANNOVAR input (see finemap_prepare_annoVar).
 
     Uses ANNOVAR to add gene-based annotation to the prepared input,
     using annotate_variation.pl.
 
-    Reads the final ANNOVAR input back and returns it as an internal
-    dataframe, removes unnecessary columns, and merges it using rsid as
-    an index to add the posterior probability from the original  .cred
-    file.
+    Removes unnecessary columns from the annotated dataframe, and merges
+    it using rsid as an index to add the posterior probability from the
+    original .cred file (see finemap_annotated).
     """
-    with tempfile.TemporaryDirectory() as tempdir:
-        # make a list of rsids in credible SNP set
-        rsid_list = list(cred_snps[cred_snps.columns[0]])
-        # select locus DF information about rsids in credible SNP set
-        locus_df = locus_df[locus_df['rsid'].isin(rsid_list)]
-        cred_snps_prepared = prepare_df_annoVar(locus_df)
-        # make file in tempdir
-        to_annovar = os.path.join(tempdir, "to_annovar")
-        cred_snps_prepared.to_csv(to_annovar, sep='\t', index=False,
-                                  header=False, float_format='%g')
-        # perform annotation with ANNOVAR (give input, standard output)
-        cmd = (f"{config.annovar_dir}/annotate_variation.pl -geneanno "
-               "-dbtype refGene -buildver hg19 "
-               f"{to_annovar} {config.annovar_dir}/humandb/")
-        os.system(cmd)
-        # read back in my temp output files as a dataframe with column names
-        colnames = ['var_effect', 'genes', 'chromosome','position','position2',
-                    'allele1','allele2','rsid','all_total','cases_total',
-                    'controls_total','maf','pvalue','beta','se','index_rsid',
-                    'ABF','pp']
-        df = read.annovar(to_annovar + ".variant_function",
-        to_annovar + ".exonic_variant_function", colnames)
-        # Drop unnecessary columns from locus SNPs dataframe before merge
-        df = df.drop(['position2', 'ABF','pp'], axis=1)
-        df = pd.merge(df, cred_snps, how='left',on='rsid')
-        df = df.sort_values('pp', ascending=False)
+    df = annotation_annoVar(finemap_prepare_annoVar(cred_snps, locus_df))
+    return finemap_annotated(df, cred_snps)
+
+def finemap_prepare_annoVar(cred_snps, locus_df):
+    """Select the locus dataframe rows of the SNPs in a FINEMAP .cred file, prepared as ANNOVAR input."""
+    # make a list of rsids in credible SNP set
+    rsid_list = list(cred_snps[cred_snps.columns[0]])
+    # select locus DF information about rsids in credible SNP set
+    locus_df = locus_df[locus_df['rsid'].isin(rsid_list)]
+    return prepare_df_annoVar(locus_df)
+
+def finemap_annotated(df, cred_snps):
+    """Add the FINEMAP .cred posterior probabilities to an annotated dataframe from finemap_prepare_annoVar."""
+    # Drop unnecessary columns from locus SNPs dataframe before merge
+    df = df.drop(['position2', 'ABF','pp'], axis=1)
+    df = pd.merge(df, cred_snps, how='left',on='rsid')
+    df = df.sort_values('pp', ascending=False)
     return df
@@ -1,8 +1,11 @@
 import os
 
 annovar_dir='annovar'
+annovar_buildver='hg19'
+annovar_dbtype='refGene'
 finemap_dir='finemap'
 genetic_map_dir='genetic_maps'
+genetic_map_compiled_dir='compiled'
 ldstore_dir='LDstore'
 plink_basename_dir = os.path.join(ldstore_dir, "data")
 paintor_dir='PAINTOR_V3.0'
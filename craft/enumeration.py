@@ -0,0 +1,169 @@
+import itertools
+import math
+import os
+import tempfile
+import concurrent.futures
+
+import numpy as np
+
+import craft.config as config
+import craft.ldstore as ldstore
+import craft.log as log
+import craft.manifest as mf
+import craft.read as read
+
+def config_chunks(m, k, chunk=100000):
+    """ Yield all configurations of k of m SNPs, as arrays of up to chunk rows of k SNP indices. """
+    combinations = itertools.combinations(range(m), k)
+    while True:
+        configs = np.fromiter(itertools.chain.from_iterable(itertools.islice(combinations, chunk)), dtype=np.int64)
+        if not len(configs):
+            return
+        yield configs.reshape(-1, k)
+
+def log_bf_sums(z, ld, max_causal, s2, chunk=100000):
+    """ Return the log Bayes factor sums of all configurations of up to max_causal causal SNPs of a locus.
+
+    Each configuration c of causal SNPs has the multivariate normal likelihood z ~ N(0, R + s2 R_c R_c')
+    against the null z ~ N(0, R), giving (as for FINEMAP)
+
+        log BF = s2/2 z_c'(I + s2 R_cc)^-1 z_c - 1/2 log det(I + s2 R_cc)
+
+    Configurations of each size are evaluated in chunks: the LD sub-blocks R_cc of a chunk are
+    gathered into one (chunk x k x k) array, and their determinants and solves are batched LAPACK calls.
+    Returns S, with S[k] the log of the sum of the Bayes factors of configurations of k SNPs,
+    and T, with T[k, j] the log of the sum over those including SNP j (S[0] = 0, for no causal SNP).
+    """
+    m = len(z)
+    S = np.full(max_causal + 1, -np.inf)
+    T = np.full((max_causal + 1, m), -np.inf)
+    S[0] = 0.0
+    for k in range(1, min(max_causal, m) + 1):
+        top = -np.inf # running maximum, so sums are kept as exp(log BF - top)
+        total = 0.0
+        per_snp = np.zeros(m)
+        eye = np.eye(k)
+        for configs in config_chunks(m, k, chunk):
+            A = eye + s2 * ld[configs[:, :, None], configs[:, None, :]]
+            z_c = z[configs]
+            sign, logdet = np.linalg.slogdet(A)
+            quad = (z_c * np.linalg.solve(A, z_c[:, :, None])[:, :, 0]).sum(axis=1)
+            lbf = np.where(sign > 0, 0.5 * s2 * quad - 0.5 * logdet, -np.inf)
+            if not np.isfinite(lbf.max()):
+                continue
+            if lbf.max() > top:
+                scale = math.exp(top - lbf.max()) if np.isfinite(top) else 0.0
+                total *= scale
+                per_snp *= scale
+                top = lbf.max()
+            weights = np.exp(lbf - top)
+            total += weights.sum()
+            per_snp += np.bincount(configs.ravel(), np.repeat(weights, k), minlength=m)
+        with np.errstate(divide='ignore'):
+            S[k] = top + np.log(total)
+            T[k] = top + np.log(per_snp)
+    return S, T
+
+def log_prior(m, k, p):
+    """ The log prior probability of one configuration of k of m SNPs, each causal with probability p. """
+    return k * math.log(p) + (m - k) * math.log1p(-p)
+
+def posteriors(S, T, m, p):
+    """ Return the posterior probability of each number of causal SNPs and each SNP's posterior inclusion probability. """
+    k = np.arange(len(S))
+    log_k = S + np.array([log_prior(m, i, p) for i in k])
+    prob_k = np.exp(log_k - np.logaddexp.reduce(log_k))
+    with np.errstate(invalid='ignore'):
+        pip = (prob_k[1:, None] * np.exp(T[1:] - S[1:, None])).sum(axis=0)
+    return prob_k, np.nan_to_num(pip)
+
+def estimate_prior(sums, sizes, tol=1e-8, max_iter=1000):
+    """ Estimate the probability that a SNP is causal, shared by all loci, by EM.
+
+    As PAINTOR does with a single (all-ones) annotation, the prior causal probability p is chosen to
+    maximise the likelihood of all loci together: each EM step sets p to the expected number of causal
+    SNPs over the number of SNPs. sums are the (S, T) of each locus (see log_bf_sums), and sizes
+    their numbers of SNPs. Returns p and the number of iterations.
+    """
+    p = 1 / np.mean(sizes)
+    for iteration in range(1, max_iter + 1):
+        expected = sum((np.arange(len(S)) * posteriors(S, T, m, p)[0]).sum() for (S, T), m in zip(sums, sizes))
+        p_new = min(max(expected / sum(sizes), 1e-12), 1 - 1e-12)
+        if abs(p_new - p) < tol:
+            return p_new, iteration
+        p = p_new
+    return p, max_iter
+
+def enumerate_loci(data_dfs, index_df, file_dir, max_causal=2, prior_std=0.05, ld_workers=None, ld_threads=1, ld_cache=None, ld_mode='locus', manifest=None):
+    """ Fine-map loci by exact enumeration of all configurations of up to max_causal causal SNPs, in-process.
+
+    An alternative to running PAINTOR (-enumerate, with a dummy annotation) on all loci: LD matrices
+    are made by LDstore as for FINEMAP (see craft.ldstore.ld_matrices), and each locus's Bayes factors
+    are summed (see log_bf_sums) as soon as its LD matrix is ready, up to ld_workers loci at once.
+    The prior variance of effects is FINEMAP's (n_samples * prior_std**2), and the prior causal
+    probability of SNPs is estimated from all loci (see estimate_prior).
+
+    Writes a PAINTOR-style results file (the locus's SNPs and z-scores, with a Posterior_Prob
+    column of posterior inclusion probabilities) for each locus to file_dir, and returns the
+    results dataframes. If manifest is given, each locus's Bayes factor sums are saved (to a
+    .enumerate.npz file) and kept for later runs from the same inputs; the prior and results,
+    which are quick to make from them, are always remade.
+    """
+    with tempfile.TemporaryDirectory() as tempdir:
+        ld_jobs = []
+        loci = []
+        for i, data in enumerate(data_dfs):
+            chr = index_df.at[i, 'chromosome']
+            index = index_df.at[i, 'rsid']
+            data = data[['chromosome', 'position', 'rsid', 'allele1', 'allele2']].assign(ZSCORE=(data['beta'] / data['se']).values)
+            data.columns = ['CHR', 'POS', 'RSID', 'ALLELE1', 'ALLELE2', 'ZSCORE']
+            variant_file = os.path.join(file_dir, index + "_variant.txt")
+            ld_file = os.path.join(file_dir, index + ".ld")
+
+            # order of SNPs in LD file must correspond to order in results file
+            variants = data[['RSID', 'POS', 'CHR', 'ALLELE1', 'ALLELE2']]
+            variants.to_csv(variant_file, sep=' ', index=False, header=['RSID','position','chromosome','A_allele','B_allele'], float_format='%g')
+            ld_jobs.append(dict(plink_basename=os.path.join(config.plink_basename_dir, f"chr{chr}_ld_panel"),
+                                region_start=index_df.at[i, 'region_start_cm'], region_end=index_df.at[i, 'region_end_cm'],
+                                variant_file=variant_file, bcor_file=os.path.join(tempdir, index + ".bcor"), ld_file=ld_file))
+            loci.append(dict(index=index, data=data, ld_file=ld_file, results_file=os.path.join(file_dir, index + ".results"),
+                             sums_file=os.path.join(file_dir, index + ".enumerate.npz"),
+                             s2=float(index_df.at[i, 'all_total']) * prior_std**2))
+
+        def sums(i):
+            locus = loci[i]
+            if manifest:
+                key = mf.key(locus['data'], mf.file_key(locus['ld_file']), max_causal, locus['s2'])
+                if manifest.done('enumerate', locus['index'], key):
+                    with np.load(locus['sums_file']) as npz:
+                        return npz['S'], npz['T']
+            ld = read.ld(locus['ld_file']).reshape(len(locus['data']), len(locus['data']))
+            S, T = log_bf_sums(locus['data'].ZSCORE.values, ld, max_causal, locus['s2'])
+            if manifest:
+                tmp = f"{locus['sums_file']}.{os.getpid()}.npz"
+                np.savez(tmp, S=S, T=T)
+                os.replace(tmp, locus['sums_file'])
+                manifest.record('enumerate', locus['index'], key, [locus['sums_file']])
+            return S, T
+
+        # make LD files for all loci concurrently, summing each locus's Bayes factors once its LD file is ready
+        workers = ld_workers or max(1, (os.cpu_count() or 1) // ld_threads)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            ldstore.ld_matrices(ld_jobs, ld_workers, ld_threads, ld_cache, ld_mode,
+                                done=lambda i: futures.update({i: pool.submit(sums, i)}), manifest=manifest)
+            missing = [ld_jobs[i]['ld_file'] for i in range(len(loci)) if i not in futures]
+            if missing:
+                log.error(f"Error: LD matrix not made for {', '.join(missing)}")
+            locus_sums = [futures[i].result() for i in range(len(loci))]
+
+    sizes = [len(locus['data']) for locus in loci]
+    p, iterations = estimate_prior(locus_sums, sizes)
+    log.log(f"Enumeration: prior causal probability {p:.3g} per SNP, estimated in {iterations} EM iterations")
+    results = []
+    for locus, (S, T), m in zip(loci, locus_sums, sizes):
+        prob_k, pip = posteriors(S, T, m, p)
+        data = locus['data'].assign(Posterior_Prob=pip)
+        data.to_csv(locus['results_file'], sep=' ', index=False, float_format='%g')
+        results.append(data)
+    return results
@@ -1,12 +1,18 @@
 import sys
 import os
 import tempfile
+import concurrent.futures
 
 import pandas as pd
 
 import craft.config as config
+import craft.ldstore as ldstore
+import craft.manifest as mf
+import craft.sss as sss
+import craft.susie as susie
+import craft.tools as tools
 
-def finemap(data_dfs, index_df, file_dir, n_causal_snps):
+def finemap(data_dfs, index_df, file_dir, n_causal_snps, ld_workers=None, ld_threads=1, ld_cache=None, ld_mode='locus', on_cred=None, manifest=None, tool='finemap'):
     """ Runs Finemap and LDStore on each SNP locus.
 
     Finemap(v1.3.1) was created by Christian Brenner (http://www.christianbenner.com/) and uses summary statistics for finemapping.
@@ -41,15 +47,30 @@ def finemap(data_dfs, index_df, file_dir, n_causal_snps):
     **OUTPUT**
 
 
+    LDstore is run for up to `ld_workers` loci at once, each with `ld_threads` threads
+    (see craft.ldstore.ld_matrices), using LD matrices from ld_cache (a craft.ldcache.LDCache)
+    where possible. With ld_mode 'region' or 'chromosome', overlapping loci (or all loci on a
+    chromosome) share one bcor file.
+
+    FINEMAP is run for each locus (with its own master file) as soon as its LD matrix is ready,
+    up to ld_workers loci at once, so FINEMAP and LDstore overlap. If on_cred is given,
+    on_cred(i, cred_file) is called (in a worker thread) as soon as FINEMAP has finished
+    locus data_dfs[i], e.g. to start annotating it.
+
+    If manifest (a craft.manifest.Manifest) is given, LD matrices and FINEMAP results made by an
+    earlier run from the same inputs are kept (and on_cred is still called), and new ones are recorded.
+
+    With tool 'native', each locus is fine-mapped in-process by craft.sss (a shotgun stochastic search
+    like FINEMAP's) instead of by the FINEMAP binary, from the same files and to the same outputs.
+    With tool 'susie', each locus is fine-mapped in-process by craft.susie (SuSiE-RSS), giving the
+    same .snp and .cred outputs (but no .config).
     """
+    engines = {'native': sss.finemap, 'susie': susie.finemap}
     with tempfile.TemporaryDirectory() as tempdir:
-        # make an empty master file
-        master = pd.DataFrame(columns=['z','ld','snp','config','cred','log', 'n_samples'])
-
-        ld_store_executable = os.path.join(config.ldstore_dir, "ldstore")
-        master_file = os.path.join(tempdir, "master_file")
-        master = open(master_file, "w")
-        master.write("z;ld;snp;config;cred;log;n_samples\n")
+        master_rows = []
+        cred_files = []
+        locus_files = []
+        ld_jobs = []
 
         # need to take in index_df region definitions.
         index_count = 0
@@ -83,29 +104,49 @@ def finemap(data_dfs, index_df, file_dir, n_causal_snps):
             variants = data[['rsid','position','chromosome','allele1','allele2']]
             variants.to_csv(variant_file, sep=' ', index=False, header=['RSID','position','chromosome','A_allele','B_allele'], float_format='%g')
 
-            # make an LD file (bcor)
-            cmd = (ld_store_executable + " --bplink " + plink_basename + f" --bcor {bcor_file} --incl-range {region_start_cm}-{region_end_cm} --n-threads 1")
-            os.system(cmd)
-
-            # make an LD file matrix for our rsids in locus (matrix)
-            cmd = (ld_store_executable + f" --bcor {bcor_file}_1 --matrix {ld_file} --incl-variants {variant_file}")
-            os.system(cmd)
+            # queue LD file (bcor, then matrix) generation for this locus
+            ld_jobs.append(dict(plink_basename=plink_basename,
+                                region_start=region_start_cm, region_end=region_end_cm,
+                                variant_file=variant_file, bcor_file=bcor_file, ld_file=ld_file))
 
-            # append row to master file
-            master.write(f"{z_file};{ld_file};{snp_file};{config_file};{cred_file};{log_file};{index_df.at[index_count, 'all_total']}\n")
+            # master file row for this locus
+            master_rows.append(f"{z_file};{ld_file};{snp_file};{config_file};{cred_file};{log_file};{index_df.at[index_count, 'all_total']}\n")
+            cred_files.append(cred_file)
+            locus_files.append(dict(index=index, z=z_file, ld=ld_file, outputs=[snp_file, cred_file] if tool == 'susie' else [snp_file, config_file, cred_file]))
 
             # increment index count to bring in new region definition.
             index_count+=1
 
-        # Write completed master file out for use
-        master.close()
-
-        # run finemap (tell it data files are in temp directory)
-        if n_causal_snps:
-            cmd = (f"{config.finemap_dir}" + "/finemap_v1.3.1_x86_64" + f" --sss --in-files {master_file} --log  --n-causal-snps {n_causal_snps}")
-            os.system(cmd)
-        else:
-            cmd = (f"{config.finemap_dir}" + "/finemap_v1.3.1_x86_64" + f" --sss --in-files {master_file} --log")
-            os.system(cmd)
+        def run_finemap(i):
+            files = locus_files[i]
+            if manifest:
+                with open(files['z'], "rb") as z, open(files['ld'], "rb") as ld:
+                    key = mf.key(z.read(), ld.read(), master_rows[i].split(";")[-1], n_causal_snps, tool)
+            if not (manifest and manifest.done('finemap', files['index'], key)):
+                if tool in engines:
+                    engines[tool](*master_rows[i].strip().split(";"), n_causal_snps)
+                else:
+                    # write a master file for this locus, and run finemap (tell it data files are in temp directory)
+                    master_file = os.path.join(tempdir, f"master_file_{i}")
+                    with open(master_file, "w") as master:
+                        master.write("z;ld;snp;config;cred;log;n_samples\n")
+                        master.write(master_rows[i])
+                    cmd = [os.path.join(config.finemap_dir, "finemap_v1.3.1_x86_64"), "--sss", "--in-files", master_file, "--log"]
+                    if n_causal_snps:
+                        cmd += ["--n-causal-snps", n_causal_snps]
+                    tools.run(cmd, "finemap")
+                if manifest:
+                    manifest.record('finemap', files['index'], key, files['outputs'])
+            if on_cred:
+                on_cred(i, cred_files[i])
+
+        # make LD files for all loci concurrently, running finemap on each locus once its LD file is ready
+        workers = ld_workers or max(1, (os.cpu_count() or 1) // ld_threads)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = []
+            ldstore.ld_matrices(ld_jobs, ld_workers, ld_threads, ld_cache, ld_mode,
+                                done=lambda i: futures.append(pool.submit(run_finemap, i)), manifest=manifest)
+            for future in futures:
+                future.result()
 
     return 0
@@ -1,141 +1,223 @@
+import bisect
 import sys
 import os
 
 import pandas as pd
 import numpy as np
-import scipy.interpolate
 
-def interpolate_cm(bp, map_file):
-    """ TODO: summary docstring line.
+def map_arrays(map_file):
+    """ Return the sorted (position, cM) arrays of a genetic map dataframe. """
+    return np.asarray(map_file['Position(bp)'].values), np.asarray(map_file['Map(cM)'].values)
 
-    Given a base position and recombination map file return the recombination
-    distance (in centimorgans, cM). Interpolate if required.
+def interpolate_linear(x, map_x, map_y):
+    """ Linearly interpolate map_y at each x, exactly as scipy.interpolate.interp1d does.
+
+    Each x is placed in the map interval found by a (left) binary search, clipped to
+    the first and last intervals.
     """
-    if bp in map_file['Position(bp)'].values:
-        cm = map_file['Map(cM)'].loc[map_file['Position(bp)'] == bp].real.astype(float)[0]
+    hi = np.searchsorted(map_x, x).clip(1, len(map_x) - 1)
+    lo = hi - 1
+    slope = (map_y[hi] - map_y[lo]) / (map_x[hi] - map_x[lo])
+    return slope * (x - map_x[lo]) + map_y[lo]
 
-    else:
-        index_location = np.searchsorted(np.array(map_file['Position(bp)']), bp)
+def interpolate_cm_array(positions, map_position, map_cm):
+    """ Return the recombination distance (cM) of many base positions at once.
 
-        # get flanking base positions
-        lower_bp = map_file['Position(bp)'].ix[index_location -1]
-        upper_bp = map_file['Position(bp)'].ix[index_location]
+    positions need not be sorted; map_position and map_cm are the sorted map arrays
+    (see map_arrays). Positions on the map get its cM value; others are interpolated.
+    """
+    positions = np.asarray(positions)
+    cm = interpolate_linear(positions, map_position, map_cm)
+    i = np.searchsorted(map_position, positions).clip(0, len(map_position) - 1)
+    exact = map_position[i] == positions
+    cm[exact] = map_cm[i[exact]]
+    return cm
 
-        # interpolate map
-        interpolation_range_bp = range(lower_bp,upper_bp,1)
-        cm_interpolator = scipy.interpolate.interp1d(map_file['Position(bp)'], map_file['Map(cM)'])
-        interpolation_range_cm = cm_interpolator(interpolation_range_bp)
+def interpolate_bp_array(cms, map_position, map_cm):
+    """ Return the base position of many genetic distances (cM) at once.
 
-        cm = interpolation_range_cm[interpolation_range_bp.index(bp)]
+    For each cM, the flanking map positions are found by binary search. The result is
+    the base position, from the lower flanking position up to (not including) the upper,
+    whose interpolated cM is closest, taking the lowest position on ties. Rather than
+    interpolating every base position in between, only the integers around the exact
+    linear solution are compared.
+    """
+    cms = np.asarray(cms, dtype=float)
+    i = np.searchsorted(map_cm, cms).clip(1, len(map_cm) - 1)
+    lower, upper = map_position[i - 1], map_position[i]
+    cm0, cm1 = map_cm[i - 1], map_cm[i]
+
+    # exact (real) solution within each interval
+    with np.errstate(divide='ignore', invalid='ignore'):
+        guess = lower + (cms - cm0) * (upper - lower) / (cm1 - cm0)
+    guess = np.where(np.isfinite(guess), guess, lower)
+
+    # compare the integer positions either side of it (rows: targets, columns: candidates)
+    offsets = np.arange(-2, 3)
+    candidates = np.floor(guess).astype(np.int64)[:, None] + offsets
+    candidates = np.clip(candidates, lower[:, None], (upper - 1)[:, None])
+    distance = np.abs(interpolate_linear(candidates, map_position, map_cm) - cms[:, None])
+    # lowest position among the closest candidates
+    closest = distance == distance.min(axis=1)[:, None]
+    return np.where(closest, candidates, np.iinfo(np.int64).max).min(axis=1)
 
-    return cm
+def interpolate_cm(bp, map_file):
+    """ Return the recombination distance (cM) of a base position.
+
+    Given a base position and recombination map file return the recombination
+    distance (in centimorgans, cM). Interpolate if required.
+    """
+    map_position, map_cm = map_arrays(map_file)
+    return interpolate_cm_array([bp], map_position, map_cm)[0]
 
 def interpolate_bp(cm, map_file):
-    """ TODO: summary docstring line.
+    """ Return the base position of a genetic distance (cM).
 
     Given a genetic distance (cM) and chromosome return the base position. Exact matching not performed as precision of floating points for cM a match is unlikely. Base position with closest cM is returned.
     """
-    index_location = np.searchsorted(np.array(map_file['Map(cM)']), cm)
-
-    # get flanking base positions
-    lower_bp = map_file['Position(bp)'].ix[index_location -1]
-    upper_bp = map_file['Position(bp)'].ix[index_location]
-
-    # interpolate map
-    interpolation_range_bp = range(lower_bp,upper_bp,1)
-    cm_interpolator = scipy.interpolate.interp1d(map_file['Position(bp)'], map_file['Map(cM)'])
-    interpolation_range_cm = cm_interpolator(interpolation_range_bp)
-    bp = interpolation_range_bp[abs(interpolation_range_cm - cm).argmin()]
-
-    return bp
+    map_position, map_cm = map_arrays(map_file)
+    return interpolate_bp_array([cm], map_position, map_cm)[0]
+
+def region_bounds_cm(df, distance, maps):
+    """ Return the region (start, end) base positions around every SNP in df, for a distance in cM. """
+    region_start = np.zeros(len(df), dtype=np.int64)
+    region_end = np.zeros(len(df), dtype=np.int64)
+    chromosomes = np.asarray(df.chromosome.astype(int))
+    for chromosome in np.unique(chromosomes):
+        rows = chromosomes == chromosome
+        map_position, map_cm = map_arrays(maps[str(chromosome)])
+        cm = interpolate_cm_array(np.asarray(df.position)[rows], map_position, map_cm)
+        region_start[rows] = interpolate_bp_array(cm - distance, map_position, map_cm)
+        region_end[rows] = interpolate_bp_array(cm + distance, map_position, map_cm)
+    return region_start, region_end
+
+def region_bounds_bp(df, distance):
+    """ Return the region (start, end) base positions around every SNP in df, for a distance in bp. """
+    position = np.asarray(df.position, dtype=np.int64)
+    return position - distance, position + distance
+
+def select_index_snps(df, alpha, region_bounds):
+    """ Return the row numbers of the index SNPs in df, in order of selection.
+
+    Repeatedly selects the SNP with the lowest p value <= alpha (the first, on ties),
+    then discards every SNP within its region. region_bounds(df) must return the
+    (start, end) arrays of the region around each SNP in df.
+
+    Significant SNPs are sorted by p value once; claimed regions are kept as sorted,
+    disjoint (merged) intervals, so each SNP is checked with a binary search.
+    """
+    significant = np.flatnonzero(np.asarray(df.pvalue <= alpha))
+    pvalues = np.asarray(df.pvalue, dtype=float)[significant]
+    candidates = significant[np.argsort(pvalues, kind='stable')]
+    positions = np.asarray(df.position)[candidates]
+    region_start, region_end = region_bounds(df.iloc[candidates])
+
+    starts, ends = [], []
+    selected = []
+    for i, position in enumerate(positions):
+        # skip SNPs within a claimed region
+        k = bisect.bisect_right(starts, position) - 1
+        if k >= 0 and position <= ends[k]:
+            continue
+        selected.append(candidates[i])
+        # claim the region, merging it with any intervals it overlaps
+        start, end = region_start[i], region_end[i]
+        lo = bisect.bisect_left(ends, start)
+        hi = bisect.bisect_right(starts, end)
+        if lo < hi:
+            start, end = min(start, starts[lo]), max(end, ends[hi - 1])
+        starts[lo:hi] = [start]
+        ends[lo:hi] = [end]
+    return selected
 
 def get_index_snps_cm(df, alpha, distance, mhc, maps):
-    """ Return a dataframe of index SNPs (with p > alpha)
+    """ Return a dataframe of index SNPs (with p <= alpha)
 
-    This function selects the SNP with the lowest p value > alpha, adds it to the list of index SNPs, discards everything within 'distance' range.
+    This function selects the SNP with the lowest p value <= alpha, adds it to the list of index SNPs, discards everything within 'distance' range.
     """
-    # create df for results
-    col_names = list(df.columns.values) + ['region_start_cm','region_end_cm', 'region_size_kb']
-    index_df = pd.DataFrame(columns=col_names)
-    chr = df.chromosome.unique()[0]
-
     # exclude MHC region
-    if not mhc and chr == 6:
-        df = df.ix[~df.position.between(25000000, 35000000)]
+    if not mhc and len(df) and df.chromosome.iloc[0] == 6:
+        df = df.loc[~df.position.between(25000000, 35000000)]
 
     # get df of all index SNPs
-    while df.pvalue.min() <= alpha:
-
-        # get current index SNP
-        index_snp = df.ix[df.pvalue.idxmin()]
-
-        # define region boundaries
-        index_snp_cm = interpolate_cm(index_snp.position,maps[str(index_snp.chromosome.astype(int))])
-        region_start = interpolate_bp(index_snp_cm - distance,maps[str(index_snp.chromosome.astype(int))])
-        region_end = interpolate_bp(index_snp_cm + distance,maps[str(index_snp.chromosome.astype(int))])
-        region_size = round((region_end - region_start)/float(1000),1)
-        index_snp = index_snp.append(pd.Series([region_start,region_end,region_size], index=['region_start_cm','region_end_cm','region_size_kb']))
-
-        # add current index SNP to index_df
-        index_df = index_df.append(index_snp, ignore_index=True)
-
-        # exclude index SNP region
-        df = df.ix[~df.position.between(region_start, region_end)]
-
-    index_df.region_start_cm = index_df.region_start_cm.astype(int)
-    index_df.region_end_cm = index_df.region_end_cm.astype(int)
+    selected = select_index_snps(df, alpha, lambda snps: region_bounds_cm(snps, distance, maps))
+    index_df = df.iloc[selected].reset_index(drop=True)
+
+    # define region boundaries
+    region_start, region_end = region_bounds_cm(index_df, distance, maps)
+    index_df['region_start_cm'] = region_start.astype(int)
+    index_df['region_end_cm'] = region_end.astype(int)
+    # Python's round (correct decimal rounding), as numpy.round may round differently
+    index_df['region_size_kb'] = [round(size / float(1000), 1) for size in (region_end - region_start).tolist()]
     return index_df
 
 def get_index_snps_bp(df, alpha, distance, mhc):
-    """ TODO: docstring. """
-    # create df for results
-    col_names = list(df.columns.values) + ['region_start_bp','region_end_bp']
-    index_df = pd.DataFrame(columns=col_names)
+    """ Return a dataframe of index SNPs (with p <= alpha)
 
+    As get_index_snps_cm, with a region of 'distance' base pairs either side of each index SNP.
+    """
     # exclude MHC region
     if not mhc:
-        df = df.ix[~df.position.between(25000000, 35000000)]
+        df = df.loc[~df.position.between(25000000, 35000000)]
 
     # get df of all index SNPs
-    while df.pvalue.min() <= alpha:
+    selected = select_index_snps(df, alpha, lambda snps: region_bounds_bp(snps, distance))
+    index_df = df.iloc[selected].reset_index(drop=True)
 
-        # get current index SNP
-        index_snp = df.ix[df.pvalue.idxmin()]
+    # define region boundaries
+    region_start, region_end = region_bounds_bp(index_df, distance)
+    index_df['region_start_bp'] = region_start.astype(int)
+    index_df['region_end_bp'] = region_end.astype(int)
+    return index_df
 
-        # define region boundaries
-        region_start = index_snp.position - distance
-        region_end = index_snp.position + distance
-        index_snp = index_snp.append(pd.Series([region_start,region_end], index=['region_start_bp','region_end_bp']))
+def unchanged_loci(index, previous_index, distance_unit):
+    """ Return the index SNP rsids whose locus is unchanged from previous_index (e.g. from a run with other parameters).
 
-        # add current index SNP to index_df
-        index_df = index_df.append(index_snp, ignore_index=True)
+    A locus is unchanged if the same index SNP has the same chromosome and region bounds (in distance_unit), so it
+    has the same SNPs; its results may then be reused.
+    """
+    cols = ['rsid', 'chromosome', f'region_start_{distance_unit}', f'region_end_{distance_unit}']
+    if any(col not in previous_index for col in cols):
+        return set()
+    keys = lambda df: set(zip(*(df[col].astype(str) if col in ('rsid', 'chromosome') else df[col] for col in cols)))
+    return {key[0] for key in keys(index) & keys(previous_index)}
 
-        # exclude index SNP region
-        df = df.ix[~df.position.between(region_start, region_end)]
+def get_locus_ranges(snps, index, distance_unit):
+    """ Find the rows of SNPs near each index SNP, without copying them.
 
-    index_df.region_start_bp = index_df.region_start_bp.astype(int)
-    index_df.region_end_bp = index_df.region_end_bp.astype(int)
-    return index_df
+    Returns snps sorted by position (unchanged, if it already was) and the (start, stop)
+    row number arrays of each index SNP's region within it, found by binary search.
+    """
+    if not snps.position.is_monotonic_increasing:
+        snps = snps.sort_values('position', kind='stable')
+    positions = snps.position.values
+    start = np.searchsorted(positions, index[f'region_start_{distance_unit}'].values, side='left')
+    stop = np.searchsorted(positions, index[f'region_end_{distance_unit}'].values, side='right')
+    return snps, start, stop
+
+def get_locus_table(snps, index, distance_unit, columns=None):
+    """ Create one dataframe of the SNPs near all index SNPs, keyed by index_rsid.
+
+    Only the given columns (by default, all, with position first) are materialised.
+    A SNP in several loci appears once for each.
+    """
+    snps, start, stop = get_locus_ranges(snps, index, distance_unit)
+    if columns is None:
+        columns = ['position'] + [col for col in snps.columns if col != 'position']
+    sizes = stop - start
+    # row numbers of every locus, concatenated
+    rows = np.arange(sizes.sum()) + np.repeat(start - np.cumsum(sizes) + sizes, sizes)
+    table = snps.iloc[rows, [snps.columns.get_loc(col) for col in columns]].reset_index(drop=True)
+    table['index_rsid'] = np.repeat(index.rsid.values, sizes)
+    return table
 
 def get_locus_snps(snps, index, distance_unit):
-    """ Create dataframe of SNPs near index SNPs."""
-    snps = snps.set_index('position')
-    snps['index_rsid'] = ''
-    locus_snps = pd.DataFrame(columns=snps.columns,index=pd.Index([],name='position'))
+    """ Create a list of dataframes of SNPs near each index SNP."""
+    snps, start, stop = get_locus_ranges(snps, index, distance_unit)
+    columns = ['position'] + [col for col in snps.columns if col != 'position']
     data_dfs = []
-
-    # For each index row, get the SNPs in that locus
-    for index, row in index.iterrows():
-        if distance_unit == 'cm':
-            snps_in_locus = snps.loc[row.region_start_cm:row.region_end_cm].copy()
-        elif distance_unit == 'bp':
-            snps_in_locus = snps.loc[row.region_start_bp:row.region_end_bp].copy()
-        snps_in_locus['index_rsid'] = row.rsid
-        locus_snps = locus_snps.append(snps_in_locus)
-        locus_snps = locus_snps.reset_index()
-        # instead of appending snps_in_locus to locus_snps dataframe, add the dataframe to a list.
-        data_dfs.append(locus_snps)
-        # reset locus SNPs dataframe at the end of the loop.
-        locus_snps = pd.DataFrame(columns=snps.columns,index=pd.Index([],name='position'))
-
+    for rsid, locus_start, locus_stop in zip(index.rsid, start, stop):
+        snps_in_locus = snps.iloc[locus_start:locus_stop][columns].reset_index(drop=True)
+        snps_in_locus['index_rsid'] = rsid
+        data_dfs.append(snps_in_locus)
     return data_dfs
@@ -0,0 +1,142 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import threading
+
+class LDCache:
+    """ A persistent, size-bounded cache of LDstore LD matrices.
+
+    LD matrices are stored in cache_dir, keyed by a hash of the PLINK reference panel
+    files, the region and the ordered list of variants. Both FINEMAP and PAINTOR use
+    the same LD matrices, so re-running a locus with different FINEMAP options or a
+    different finemapping tool does not need LDstore at all.
+
+    When the cache grows beyond max_bytes, the least recently used matrices are removed.
+    Hit, miss and eviction counts are kept in cache_dir/stats.json across runs.
+    """
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._panels = {}
+
+    def _locked(self):
+        """ Return an open lock file, held exclusively, shared by all processes using this cache. """
+        lock_file = open(os.path.join(self.cache_dir, ".lock"), "w")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _file_hash(self, file):
+        """ Return the sha256 of a file's content. """
+        sha = hashlib.sha256()
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def panel_hash(self, plink_basename):
+        """ Hash the .bed, .bim and .fam files of a PLINK panel.
+
+        Panels are large, so content hashes are remembered in cache_dir/panels.json,
+        and only recomputed when a file's size or modification time changes.
+        """
+        files = [plink_basename + ext for ext in (".bed", ".bim", ".fam")]
+        stamp = [[os.path.abspath(f), os.path.getsize(f), os.stat(f).st_mtime_ns] for f in files]
+        key = json.dumps(stamp)
+        if key in self._panels:
+            return self._panels[key]
+        panels_file = os.path.join(self.cache_dir, "panels.json")
+        with self._lock, self._locked():
+            panels = self._read_json(panels_file)
+            if key not in panels:
+                panels[key] = hashlib.sha256("".join(self._file_hash(f) for f in files).encode()).hexdigest()
+                self._write_json(panels_file, panels)
+            self._panels[key] = panels[key]
+        return self._panels[key]
+
+    def key(self, plink_basename, region_start, region_end, variant_file):
+        """ Return the cache key of an LD matrix. """
+        sha = hashlib.sha256()
+        sha.update(self.panel_hash(plink_basename).encode())
+        sha.update(f"{region_start}-{region_end}".encode())
+        with open(variant_file, "rb") as f:
+            sha.update(f.read())
+        return sha.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".ld")
+
+    def get(self, key, ld_file):
+        """ Copy a cached LD matrix to ld_file. Returns True on a hit, False on a miss. """
+        path = self._path(key)
+        try:
+            shutil.copyfile(path, ld_file)
+            os.utime(path) # mark as recently used
+            hit = True
+        except FileNotFoundError:
+            hit = False
+        self._count("hits" if hit else "misses")
+        return hit
+
+    def put(self, key, ld_file):
+        """ Add the LD matrix in ld_file to the cache, then evict old matrices if needed. """
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(ld_file, tmp)
+        os.replace(tmp, self._path(key))
+        self.evict()
+
+    def evict(self):
+        """ Remove least recently used LD matrices until the cache is within max_bytes. """
+        with self._lock, self._locked():
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".ld"):
+                    st = os.stat(os.path.join(self.cache_dir, name))
+                    entries.append((st.st_mtime_ns, st.st_size, name))
+            entries.sort()
+            total = sum(size for mtime, size, name in entries)
+            evicted = 0
+            for mtime, size, name in entries:
+                if total <= self.max_bytes:
+                    break
+                os.remove(os.path.join(self.cache_dir, name))
+                total -= size
+                evicted += 1
+        if evicted:
+            self._count("evictions", evicted)
+
+    def _count(self, stat, n=1):
+        """ Add n to a counter in cache_dir/stats.json. """
+        stats_file = os.path.join(self.cache_dir, "stats.json")
+        with self._lock, self._locked():
+            stats = self._read_json(stats_file)
+            stats[stat] = stats.get(stat, 0) + n
+            self._write_json(stats_file, stats)
+
+    def stats(self):
+        """ Return the cache statistics: hits, misses, evictions, entries and bytes. """
+        stats = {"hits": 0, "misses": 0, "evictions": 0}
+        stats.update(self._read_json(os.path.join(self.cache_dir, "stats.json")))
+        sizes = [os.path.getsize(os.path.join(self.cache_dir, name))
+                 for name in os.listdir(self.cache_dir) if name.endswith(".ld")]
+        stats["entries"] = len(sizes)
+        stats["bytes"] = sum(sizes)
+        return stats
+
+    def _read_json(self, file):
+        try:
+            with open(file) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_json(self, file, data):
+        tmp = file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, file)
@@ -0,0 +1,161 @@
+import os
+import tempfile
+import concurrent.futures
+
+import pandas as pd
+
+import craft.config as config
+import craft.log as log
+import craft.manifest as mf
+import craft.tools as tools
+
+def ld_matrix(plink_basename, region_start, region_end, variant_file, bcor_file, ld_file, n_threads=1, cache=None):
+    """ Make an LD matrix for the variants of one locus using LDstore.
+
+    Runs LDstore twice: once to make a bcor file of all variants in the region of the
+    PLINK reference panel, then again to write the LD matrix of the variants listed in
+    variant_file (in that order) to ld_file.
+
+    If cache (a craft.ldcache.LDCache) is given and already holds the matrix, it is
+    copied to ld_file and LDstore is not run. Raises RuntimeError if LDstore fails.
+    """
+    if cache:
+        key = cache.key(plink_basename, region_start, region_end, variant_file)
+        if cache.get(key, ld_file):
+            return ld_file
+
+    make_bcor(plink_basename, region_start, region_end, bcor_file, n_threads)
+    bcor_matrix(bcor_file, variant_file, ld_file)
+    if cache:
+        cache.put(key, ld_file)
+    return ld_file
+
+def make_bcor(plink_basename, region_start, region_end, bcor_file, n_threads=1):
+    """ Make a bcor file of all variants in a region of a PLINK reference panel using LDstore. Raises RuntimeError if LDstore fails. """
+    cmd = [os.path.join(config.ldstore_dir, "ldstore"), "--bplink", plink_basename, "--bcor", bcor_file,
+           "--incl-range", f"{region_start}-{region_end}", "--n-threads", n_threads]
+    if tools.run(cmd, "ldstore", check=False).returncode != 0:
+        raise RuntimeError(f'LDstore failed to make {bcor_file}')
+
+def bcor_matrix(bcor_file, variant_file, ld_file):
+    """ Write the LD matrix of the variants listed in variant_file (in that order) from a bcor file (see make_bcor)
+    to ld_file using LDstore. Raises RuntimeError if LDstore fails.
+    """
+    cmd = [os.path.join(config.ldstore_dir, "ldstore"), "--bcor", f"{bcor_file}_1", "--matrix", ld_file, "--incl-variants", variant_file]
+    if tools.run(cmd, "ldstore", check=False).returncode != 0:
+        raise RuntimeError(f'LDstore failed to make {ld_file}')
+
+def merge_regions(jobs, mode):
+    """ Group loci that can share one bcor file.
+
+    With mode 'chromosome', all loci using the same PLINK panel (i.e. chromosome) form
+    one group spanning all of their regions. With mode 'region', loci are only grouped
+    when their regions overlap. Returns a list of (plink_basename, region_start,
+    region_end, [job numbers]) tuples.
+    """
+    groups = []
+    order = sorted(range(len(jobs)), key=lambda i: (jobs[i]['plink_basename'], jobs[i]['region_start']))
+    for i in order:
+        job = jobs[i]
+        if groups:
+            plink_basename, start, end, members = groups[-1]
+            if plink_basename == job['plink_basename'] and (mode == 'chromosome' or job['region_start'] <= end):
+                groups[-1] = (plink_basename, start, max(end, job['region_end']), members + [i])
+                continue
+        groups.append((job['plink_basename'], job['region_start'], job['region_end'], [i]))
+    return groups
+
+def region_ld_matrix(group, jobs, tempdir, n_threads=1, cache=None):
+    """ Make the LD matrices of a group of loci (see merge_regions) from one bcor file.
+
+    LDstore is run once to make a bcor file of the merged region, then once per locus to write
+    the LD matrix of the locus's variants from it to the locus's ld_file. Loci whose matrices are in
+    cache are copied from it, and LDstore is not run at all if all of them are.
+
+    Raises RuntimeError if LDstore fails, or if a locus's variant_file lists a variant more than once.
+    """
+    plink_basename, region_start, region_end, members = group
+    keys = {}
+    if cache:
+        for i in members:
+            job = jobs[i]
+            keys[i] = cache.key(job['plink_basename'], job['region_start'], job['region_end'], job['variant_file'])
+        members = [i for i in members if not cache.get(keys[i], jobs[i]['ld_file'])]
+        if not members:
+            return
+    for i in members:
+        rsids = read_variants(jobs[i]['variant_file'])['RSID']
+        if rsids.duplicated().any():
+            raise RuntimeError(f"Variants listed more than once in {jobs[i]['variant_file']}: {', '.join(rsids[rsids.duplicated()].unique())}")
+
+    bcor_file = os.path.join(tempdir, f"{os.path.basename(plink_basename)}_{region_start}-{region_end}.bcor")
+    make_bcor(plink_basename, region_start, region_end, bcor_file, n_threads)
+    for i in members:
+        bcor_matrix(bcor_file, jobs[i]['variant_file'], jobs[i]['ld_file'])
+        if cache:
+            cache.put(keys[i], jobs[i]['ld_file'])
+
+def read_variants(file):
+    """ Read an LDstore variant file (as written by finemap or paintor) into a dataframe. """
+    return pd.read_csv(file, sep=' ', dtype=str)
+
+def ld_key(job):
+    """ Hash the inputs of an LD matrix: the PLINK panel files (size and modification time), region and variants. """
+    panel = [job['plink_basename'] + ext for ext in (".bed", ".bim", ".fam")]
+    with open(job['variant_file'], "rb") as f:
+        variants = f.read()
+    return mf.key(mf.stamps([file for file in panel if os.path.exists(file)]), job['region_start'], job['region_end'], variants)
+
+def ld_matrices(jobs, workers=None, n_threads=1, cache=None, mode='locus', done=None, manifest=None):
+    """ Run ld_matrix for many loci concurrently.
+
+    jobs is a list of dictionaries of ld_matrix arguments, one per locus.
+    At most `workers` loci are run at once, each with `n_threads` LDstore threads;
+    by default, workers is chosen so that workers * n_threads fills the available CPUs.
+    Returns the LD matrix file names in the same order as jobs, once every locus has finished.
+
+    With mode 'locus', LDstore makes a bcor file and an LD matrix for every locus.
+    With mode 'region' or 'chromosome', loci are grouped (see merge_regions) and each
+    group is run with region_ld_matrix instead.
+
+    If done is given, done(i) is called (in a worker thread) as soon as the LD matrix of jobs[i] is ready.
+
+    If manifest (a craft.manifest.Manifest) is given, LD matrices made by an earlier run from the
+    same inputs (see ld_key) are not remade, and each new LD matrix is recorded in it.
+
+    Worker threads raise errors rather than exiting; the first is reported (see log.error) here.
+    """
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 1) // n_threads)
+    names = [os.path.basename(job['ld_file']) for job in jobs]
+    keys = [ld_key(job) for job in jobs] if manifest else None
+    todo = [i for i in range(len(jobs)) if not (manifest and manifest.done('ld', names[i], keys[i]))]
+    if done:
+        for i in sorted(set(range(len(jobs))) - set(todo)):
+            done(i)
+    def finished(i):
+        if manifest:
+            manifest.record('ld', names[i], keys[i], [jobs[i]['ld_file']])
+        if done:
+            done(i)
+    def locus(i):
+        ld_matrix(n_threads=n_threads, cache=cache, **jobs[i])
+        finished(i)
+    def region(group, todo_jobs, tempdir):
+        region_ld_matrix(group, todo_jobs, tempdir, n_threads, cache)
+        for j in group[3]:
+            finished(todo[j])
+    def wait(futures):
+        for future in futures:
+            try:
+                future.result()
+            except RuntimeError as e:
+                log.error(f'Error: {e}')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        if mode == 'locus':
+            wait([pool.submit(locus, i) for i in todo])
+        else:
+            todo_jobs = [jobs[i] for i in todo]
+            with tempfile.TemporaryDirectory() as tempdir:
+                wait([pool.submit(region, group, todo_jobs, tempdir) for group in merge_regions(todo_jobs, mode)])
+    return [job['ld_file'] for job in jobs]
@@ -7,4 +7,4 @@ def error(msg):
     sys.exit(1)
 
 def log(msg):
-    logging.log(msg)
+    logging.info(msg)
@@ -5,17 +5,27 @@
 import sys
 import os
 import argparse
+import concurrent.futures
 import glob
+import logging
+import multiprocessing
 
 import pandas as pd
 
 from craft import abf
+from craft import annocache
 from craft import annotate
 from craft import config
+from craft import enumeration
 from craft import log
+from craft import manifest as mf
 from craft import read
+from craft import tools
 from craft import finemap
+from craft import ldcache
 from craft import paintor
+from craft import pipeline
+from craft import refgene
 from craft import visualise
 import craft.getSNPs as gs
 
@@ -52,75 +62,341 @@ def parse_args():
         '--mhc', action='store_true',
         help='Include the MHC region. Default = %(default)s.')
     parser.add_argument(
-        '--cred_threshold', choices={'95', '99'}, default='95',
-        help='For use with ABF, choose the cut-off threshold for cumulative posterior probability when determining credible sets. Default = %(default)s.')
+        '--cred_threshold', type=float, default=95,
+        help='For use with ABF, choose the cut-off threshold for cumulative posterior probability when determining credible sets, as a percentage (e.g. 95, 99) or a proportion (e.g. 0.95). Default = %(default)s.')
     parser.add_argument(
-        '--finemap_tool', choices={'finemap', 'paintor'},
-        help='Choose which finemapping tool is used. Default = %(default)s.')
+        '--finemap_tool', choices={'finemap', 'paintor', 'native', 'susie', 'enumerate'},
+        help='Choose which finemapping tool is used: FINEMAP, PAINTOR, or native (an in-process shotgun stochastic search like FINEMAP, needing no FINEMAP binary), susie (in-process SuSiE-RSS, whose cost grows linearly with the number of causal effects) or enumerate (in-process exact enumeration of causal configurations, in place of PAINTOR). Default = %(default)s.')
     parser.add_argument(
         '--n_causal_snps', type=int,
-        help='For use with FINEMAP, specify the maximum number of causal snps considered in modelling. Default (set by FINEMAP) = 5')
-    return parser.parse_args()
+        help='For use with FINEMAP, native or enumerate, specify the maximum number of causal snps considered in modelling; with susie, the number of single effects. Default (set by FINEMAP) = 5, 10 with susie (as susieR), or 2 with enumerate (as CRAFT runs PAINTOR)')
+    parser.add_argument(
+        '--ld_workers', type=int,
+        help='For use with FINEMAP, native, susie, enumerate or PAINTOR, the number of loci for which LDstore is run at once. Default = number of CPUs / ld_threads.')
+    parser.add_argument(
+        '--ld_threads', type=int, default=1,
+        help='For use with FINEMAP, native, susie, enumerate or PAINTOR, the number of threads used by each LDstore run. Default = %(default)s.')
+    parser.add_argument(
+        '--ld_mode', choices=['locus', 'region', 'chromosome'], default='locus',
+        help='For use with FINEMAP, native, susie, enumerate or PAINTOR, make a bcor file per locus, per merged region of overlapping loci, or per chromosome; LD matrices of each locus are then taken from the shared bcor. Default = %(default)s.')
+    parser.add_argument(
+        '--ld_cache_dir',
+        help='Directory for a persistent cache of LD matrices, shared by FINEMAP and PAINTOR runs. Default = no cache.')
+    parser.add_argument(
+        '--ld_cache_size', type=int, default=10240,
+        help='Maximum size of the LD cache in MB; least recently used matrices are removed first. Default = %(default)s.')
+    parser.add_argument(
+        '--force', action='store_true',
+        help='Rerun every stage, even those unchanged since the last run (as recorded in each output directory\'s manifest.json). Default = %(default)s.')
+    parser.add_argument(
+        '--max_tools', type=int,
+        help='Maximum number of external tools (LDstore, FINEMAP, PAINTOR, ANNOVAR) run at once by each process. Default = number of CPUs.')
+    parser.add_argument(
+        '--tool_timeout', type=float,
+        help='Time limit in seconds for each run of an external tool. Default = no limit.')
+    parser.add_argument(
+        '--tool_retries', type=int, default=0,
+        help='Number of times to retry an external tool that fails or times out. Default = %(default)s.')
+    parser.add_argument(
+        '--annotator', choices=['annovar', 'native'], default='annovar',
+        help='Gene-based annotation with ANNOVAR, or native: an experimental in-process approximation from the ANNOVAR humandb refGene table, '
+             'not yet validated against ANNOVAR and not a replacement for it (var_effect and genes only, with no exonic_variant_function, '
+             'and splicing called only at intronic positions). Default = %(default)s.')
+    parser.add_argument(
+        '--annotation_cache',
+        help='SQLite database file for a persistent cache of ANNOVAR annotations; only variants not in the cache are annotated by ANNOVAR. Not used with --annotator native. Default = no cache.')
+    parser.add_argument(
+        '--stream', action='store_true',
+        help='Read input files in two streaming passes, keeping only SNPs near SNPs with p <= alpha, so memory use scales with the number of loci rather than file size. Default = %(default)s.')
+    parser.add_argument(
+        '--chunksize', type=int, default=1000000,
+        help='Number of rows read at a time with --stream. Default = %(default)s.')
+    parser.add_argument(
+        '--compact', action='store_true',
+        help='Use a compact memory schema (float32, int32, categorical chromosomes and alleles, and Arrow-backed rsid strings) for summary statistics and loci, and report the memory saved at each stage. Default = %(default)s.')
+    parser.add_argument(
+        '--cache_dir', '--cache-dir',
+        help='Directory for a cache of parsed input files, rebuilt when an input file changes. --stream is not used when reading through the cache. Default = no cache.')
+    parser.add_argument(
+        '--jobs', type=int, default=1,
+        help='Number of input files to run in parallel (in separate processes). Default = %(default)s.')
+    options = parser.parse_args()
+    if options.ld_threads < 1:
+        log.error('Error: --ld_threads must be at least 1!')
+    if options.ld_workers is not None and options.ld_workers < 1:
+        log.error('Error: --ld_workers must be at least 1!')
+    if options.annotator == 'native' and options.annotation_cache:
+        log.error('Error: --annotation_cache caches ANNOVAR annotations, and cannot be used with --annotator native!')
+    return options
+
+def run_file(file, options, maps, frq=None, submit=None):
+    """ Run the CRAFT pipeline on one input summary statistics file.
+
+    maps and frq are the genetic maps and (for plink) the .frq.cc data (see read.FrqCC),
+    read once for all files. Output for each file is written to its own directory within options.outdir.
+
+    The pipeline runs in stages: read, index, locus and abf for the whole file (see abf_stages), then
+    annotate, ld, finemap and annotate-cred for each locus. Completed stages are recorded in a manifest in
+    the output directory, and are skipped when the pipeline is rerun with the same inputs and parameters,
+    so an interrupted run resumes where it stopped (unless options.force is set).
+
+    Credible SNP sets are passed, as lists of (output file, prepared dataframe, FINEMAP .cred SNPs or None,
+    manifest checkpoint), to submit as soon as they are ready (the ABF sets before finemapping starts, and each
+    FINEMAP set as soon as its locus finishes), to be annotated by annotate_outputs. Without submit, they are
+    returned instead.
+    """
+    annotations = []
+    if submit is None:
+        submit = annotations.extend
+    file_name = os.path.basename(os.path.normpath(file))
+    file_dir = f"{options.outdir}/{file_name}"
+    if os.path.exists(file_dir) == False:
+        os.mkdir(file_dir)
+    manifest = mf.Manifest(os.path.join(file_dir, "manifest.json"), resume=not options.force)
+
+    index_df, loci = abf_stages(file, file_dir, file_name, options, maps, frq, manifest)
+
+    # Credible SNP sets
+    cred = abf.trim_credible(loci, options.cred_threshold)
+    data_list = [data for index_rsid, data in cred.groupby('index_rsid', sort=False, observed=True)]
+
+    # Stage annotate: credible SNP sets to annotate (see annotate_outputs), while finemapping runs
+    annotator = [options.annotator, config.annovar_buildver, config.annovar_dbtype]
+    abf_annotations = []
+    for data in data_list:
+        data = annotate.prepare_df_annoVar(data)
+        index_rsid = str(data.index_rsid.iloc[0])
+        key = mf.key(data, annotator)
+        if not manifest.done('annotate', index_rsid, key):
+            abf_annotations.append((f"{os.path.join(file_dir, index_rsid)}.abf.cred", data, None,
+                                    (manifest, 'annotate', index_rsid, key)))
+    submit(abf_annotations)
+
+    # Finemapping, if specified on command-line, uses a dataframe per locus (with ABF and pp columns)
+    if options.finemap_tool:
+        loci = loci.sort_index().drop(columns='cpp')
+        locus_dfs = [data for index_rsid, data in loci.groupby('index_rsid', sort=False, observed=True)]
+    ld_cache = None
+    if options.ld_cache_dir:
+        ld_cache = ldcache.LDCache(options.ld_cache_dir, options.ld_cache_size * 2**20)
+    if options.finemap_tool in ("finemap", "native", "susie"):
+        # Stages ld and finemap, then stage annotate-cred: annotate each locus's finemap cred file as soon as finemap has finished it
+        def on_cred(i, cred_file):
+            cred_dfs = read.finemap_cred(cred_file)
+            if not cred_dfs: # e.g. SuSiE found no pure credible sets
+                return
+            cred_snps = pd.concat(cred_dfs)
+            data = annotate.finemap_prepare_annoVar(cred_snps, locus_dfs[i])
+            index_rsid = index_df.rsid.iloc[i]
+            key = mf.key(cred_snps, data, annotator)
+            if not manifest.done('annotate-cred', index_rsid, key):
+                submit([(f"{os.path.join(file_dir, index_rsid)}.cred.annotated", data, cred_snps,
+                         (manifest, 'annotate-cred', index_rsid, key))])
+        finemap.finemap(locus_dfs, index_df, file_dir, options.n_causal_snps, options.ld_workers, options.ld_threads, ld_cache, options.ld_mode, on_cred, manifest, options.finemap_tool)
+    elif options.finemap_tool == "paintor":
+        paintor.paintor(locus_dfs, index_df, file_dir, options.ld_workers, options.ld_threads, ld_cache, options.ld_mode, manifest)
+    elif options.finemap_tool == "enumerate":
+        enumeration.enumerate_loci(locus_dfs, index_df, file_dir, options.n_causal_snps or 2, ld_workers=options.ld_workers,
+                                   ld_threads=options.ld_threads, ld_cache=ld_cache, ld_mode=options.ld_mode, manifest=manifest)
+    if ld_cache:
+        log.log(f"LD cache: {ld_cache.stats()}")
+    if manifest.skipped:
+        log.log(f"{file_name}: {manifest.skipped} stages unchanged since the last run, skipped")
+    return annotations
+
+def abf_stages(file, file_dir, file_name, options, maps, frq, manifest):
+    """ Run the read, index, locus and abf stages for the whole file, returning the index SNPs and the locus table.
+
+    These stages run in memory; the index SNPs and locus table (with ABF and posterior probabilities) are
+    saved to a .abf.npz file, and loaded from it instead when the input files and parameters are unchanged.
+    """
+    if options.distance_unit == 'cm': # using cM as a distance unit
+        distance = float(options.distance)
+        region_bounds = lambda snps: gs.region_bounds_cm(snps, distance, maps)
+    if options.distance_unit == 'bp': # using bp as a distance unit
+        distance = int(options.distance)
+        region_bounds = lambda snps: gs.region_bounds_bp(snps, distance)
+    files = [file, options.frq] if options.type == 'plink' else [file]
+    read_key = mf.key(mf.stamps(files), options.type, options.compact)
+    index_key = mf.key(read_key, options.distance_unit, distance, options.alpha, options.mhc,
+                       mf.stamps(maps.files.values()) if maps else None)
+    locus_key = index_key
+    abf_key = mf.key(locus_key, options.compact)
+    index_file = f"{os.path.join(file_dir, file_name)}.index"
+    abf_file = f"{os.path.join(file_dir, file_name)}.abf.npz"
+    if manifest.done('abf', file_name, abf_key):
+        dfs = read.load_dfs(abf_file)
+        return dfs['index'], dfs['loci']
+    # the results of a run on the same input with other parameters (e.g. alpha or distance), to reuse for unchanged loci
+    previous = {}
+    if manifest.resume and os.path.exists(abf_file):
+        previous = read.load_dfs(abf_file)
+        if 'meta' not in previous or previous['meta'].read_key.iloc[0] != read_key:
+            previous = {}
+
+    # Stage read: input summary statistics; when streaming, only SNPs near significant SNPs are kept,
+    # or, with a cache directory, the whole file is read once and cached for later runs.
+    stream = {}
+    if options.stream:
+        stream = dict(alpha=options.alpha, region_bounds=region_bounds, chunksize=options.chunksize)
+    args = [file, frq] if options.type == 'plink' else [file]
+    if options.cache_dir:
+        stats = read.cached(options.cache_dir, files, readers[options.type], *args)
+    else:
+        stats = readers[options.type](*args, **stream)
+    if options.compact:
+        stats = compacted('read', stats)
+    manifest.record('read', file_name, read_key, [])
+
+    # Stage index: index SNPs
+    if options.distance_unit == 'cm':
+        index_df = [gs.get_index_snps_cm(stats, options.alpha, distance, options.mhc, maps)]
+    if options.distance_unit == 'bp':
+        index_df = [gs.get_index_snps_bp(stats, options.alpha, distance, options.mhc)]
+    index_df = pd.concat(index_df)
+
+    # Output index SNPs. Float format is NOT default behaviour as this rounds to 6/7sf, use %g instead.
+    index_df.to_csv(index_file, sep='\t', index=False, float_format='%g')
+    manifest.record('index', file_name, index_key, [index_file])
+
+    # Stage locus: locus SNPs, as one table of all loci keyed by index_rsid
+    loci = gs.get_locus_table(stats, index_df, options.distance_unit)
+    if options.compact:
+        loci = compacted('locus', loci)
+    manifest.record('locus', file_name, locus_key, [])
+
+    # Stage abf: ABF and posterior probabilities for all loci at once, reusing those of unchanged loci
+    reuse = set()
+    if previous:
+        reuse = gs.unchanged_loci(index_df, previous['index'], options.distance_unit)
+        log.log(f"{file_name}: {len(reuse)} of {len(index_df)} loci unchanged since the last run")
+    loci = abf.posteriors(loci, previous.get('loci'), reuse)
+    if options.compact:
+        loci = compacted('abf', loci)
+    read.save_dfs(abf_file, {'index': index_df, 'loci': loci, 'meta': pd.DataFrame({'read_key': [read_key]})})
+    manifest.record('abf', file_name, abf_key, [index_file, abf_file])
+    return index_df, loci
+
+def annotate_outputs(annotations, cache=None, annotator=None):
+    """ Annotate credible SNP sets with a single ANNOVAR run and write them out.
+
+    annotations is a list of (output file, prepared dataframe, FINEMAP .cred SNPs or None, manifest checkpoint)
+    from run_file, for any number of loci and input files (see pipeline.BatchStage). Each output file is recorded
+    in its manifest once written. cache is an optional annocache.AnnotationCache, and annotator
+    an optional refgene.RefGene used instead of ANNOVAR.
+    """
+    annotated = annotate.annotation_annoVar_batch([data for out_file, data, cred_snps, checkpoint in annotations], cache, annotator)
+    for (out_file, prepared, cred_snps, checkpoint), data in zip(annotations, annotated):
+        if cred_snps is not None:
+            data = annotate.finemap_annotated(data, cred_snps)
+        # Output annotated SNP set. Float format is NOT default behaviour as this rounds to 6/7sf, use %g instead.
+        data.to_csv(out_file, sep='\t', index=False, float_format='%g')
+        manifest, stage, name, key = checkpoint
+        manifest.record(stage, name, key, [out_file])
+
+def compacted(stage, df):
+    """ Apply the compact schema (see read.compact) to a stage's dataframe and log the bytes saved. """
+    before = df.memory_usage(deep=True).sum()
+    df = read.compact(df)
+    after = df.memory_usage(deep=True).sum()
+    log.log(f"{stage}: {before / 2**20:.1f} MB, {after / 2**20:.1f} MB with compact schema (saved {(before - after) / 2**20:.1f} MB)")
+    return df
+
+# Read-only data shared by every file in a run (set in each pool worker by share()).
+shared = {}
+
+def share(options, maps, frq):
+    """ Make the options, genetic maps and .frq.cc data available to run_shared, and set up the external tool runner. """
+    shared['options'] = options
+    shared['maps'] = maps
+    shared['frq'] = frq
+    tools.configure(options.max_tools, timeout=options.tool_timeout, retries=options.tool_retries)
+
+def run_shared(file, submit=None):
+    """ Run the pipeline on one file, returning its annotations (see run_file), an error message rather than raising,
+    and the records of the external tools it ran (see tools.ToolRunner).
+
+    log.error exits, so SystemExit is caught too: one failed file should not abort the run.
+    """
+    try:
+        annotations, error = run_file(file, shared['options'], shared['maps'], shared['frq'], submit), None
+    except (Exception, SystemExit) as e:
+        annotations, error = [], f"{type(e).__name__}: {e}"
+    return annotations, error, tools.runner().take_records()
 
 def main():
     options = parse_args() # Define command-line specified options
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     file_names = glob.glob(options.file)
     if not file_names:
         log.error('Error: file not found!')
-    for file in file_names:
-        file_name = os.path.basename(os.path.normpath(file))
-        file_dir = f"{options.outdir}/{file_name}"
-        if os.path.exists(file_dir) == False:
-            os.mkdir(file_dir)
-        # Read input summary statistics
-        if options.type == 'plink':
-            if not options.frq:
-                log.error('Error: .frq.cc file not found!')
-            stats = read.plink(file, options.frq)
-        else:
-            reader = readers[options.type]
-            stats = reader(file)
-        # Get index SNPs
-        if options.distance_unit == 'cm': # using cM as a distance unit
-            distance = float(options.distance)
-            maps = read.maps(config.genetic_map_dir)
-            index_df = [gs.get_index_snps_cm(stats, options.alpha, distance, options.mhc, maps)]
-        if options.distance_unit == 'bp': # using bp as a distance unit
-            distance = int(options.distance)
-            index_df = [gs.get_index_snps_bp(stats, options.alpha, distance, options.mhc)]
-        index_df = pd.concat(index_df)
-
-        # Output index SNPs. Float format is NOT default behaviour as this rounds to 6/7sf, use %g instead.
-        index_df.to_csv(f"{os.path.join(file_dir, file_name)}.index", sep='\t', index=False, float_format='%g')
-
-        # Get locus SNPs
-        locus_dfs = gs.get_locus_snps(stats, index_df, options.distance_unit)
-
-        # Calculate ABF and posterior probabilities
-        data_list = abf.abf(locus_dfs, options.cred_threshold)
-
-        # Annotate credible SNP set
-        for data in data_list:
-            data = annotate.prepare_df_annoVar(data)
-            data = annotate.annotation_annoVar(data)
-            # Output credible SNP set. Float format is NOT default behaviour as this rounds to 6/7sf, use %g instead.
-            data.to_csv(f"{os.path.join(file_dir, data.index_rsid.unique()[0])}.abf.cred", sep='\t', index=False, float_format='%g')
-
-        # Finemapping, if specified on command-line.
-        if options.finemap_tool == "finemap":
-            finemap.finemap(locus_dfs, index_df, file_dir, options.n_causal_snps)
-            # Annotate finemap cred file results by iterating through index_df to find each .cred file
-            i = 0
-            for i, row in index_df.iterrows():
-                cred_file = os.path.join(file_dir, row.rsid + ".cred")
-                cred_dfs = read.finemap_cred(cred_file)
-                cred_snps = pd.concat(cred_dfs)
-                cred_snps_annotated = annotate.finemap_annotation_annoVar(cred_snps, locus_dfs[i])
-                # write annotated SNPS dataframe as output file. Float format is NOT default behaviour as this rounds to 6/7sf, use %g instead.
-                cred_snps_annotated.to_csv(f"{os.path.join(file_dir, row.rsid)}.cred.annotated", sep='\t', index=False, float_format='%g')
-                # increment index count to select next index
-                i+=1
-        elif options.finemap_tool == "paintor":
-            paintor.paintor(locus_dfs, index_df)
-
-    return 0
+    if options.type == 'plink' and not options.frq:
+        log.error('Error: .frq.cc file not found!')
+    if options.jobs < 1:
+        log.error('Error: --jobs must be at least 1!')
+
+    # Genetic maps and the .frq.cc file are read at most once; they are shared (read-only) by every file.
+    maps = None
+    if options.distance_unit == 'cm':
+        maps = read.maps(config.genetic_map_dir)
+    frq = None
+    if options.type == 'plink':
+        frq = read.FrqCC(options.frq, options.cache_dir)
+        if not options.cache_dir:
+            frq.load() # needed for every file, so read once before any worker processes start
+        elif options.jobs > 1 and len(file_names) > 1:
+            frq.save() # worker processes then each load the saved partitions, rather than read the file
+    share(options, maps, frq)
+
+    # Annotation runs in the background, on credible SNP sets of any loci and files as they are ready
+    annotation_cache = None
+    if options.annotation_cache:
+        annotation_cache = annocache.AnnotationCache(options.annotation_cache, os.path.join(config.annovar_dir, "humandb"))
+    annotator = None
+    if options.annotator == 'native':
+        log.log('Annotating with --annotator native, which is not validated against ANNOVAR (see test/annotation/compare_annovar.py)')
+        annotator = refgene.RefGene(os.path.join(config.annovar_dir, "humandb", f"{config.annovar_buildver}_{config.annovar_dbtype}.txt"))
+    annotation = pipeline.BatchStage(lambda annotations: annotate_outputs(annotations, annotation_cache, annotator))
+
+    # Each file is independent, so files may be run in a pool of worker processes.
+    # Forked workers inherit the shared data; otherwise it is passed to each worker once.
+    # Workers return their credible SNP sets, which are annotated as each file finishes.
+    if options.jobs == 1 or len(file_names) == 1:
+        try:
+            results = [run_shared(file, annotation.submit) for file in file_names]
+        except KeyboardInterrupt:
+            tools.runner().cancel() # kill running external tools
+            raise
+    else:
+        context = multiprocessing.get_context()
+        initializer, initargs = (None, ()) if context.get_start_method() == 'fork' else (share, (options, maps, frq))
+        results = []
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=options.jobs, mp_context=context, initializer=initializer, initargs=initargs) as pool:
+            for file_annotations, error, records in pool.map(run_shared, file_names):
+                annotation.submit(file_annotations)
+                results.append((file_annotations, error, records))
+
+    # Wait for annotation to finish
+    annotation_failed = False
+    try:
+        annotation.close()
+    except (Exception, SystemExit) as e:
+        log.log(f"Failed: annotation: {type(e).__name__}: {e}")
+        annotation_failed = True
+    if annotation_cache:
+        log.log(f"Annotation cache: {annotation_cache.stats()}")
+
+    # Summarise the time and memory used by external tools
+    records = [record for file_annotations, error, file_records in results for record in file_records]
+    for line in tools.summary(records + tools.runner().take_records()):
+        log.log(line)
+
+    # Summarise failures per file
+    failed = [(file, error) for file, (file_annotations, error, records) in zip(file_names, results) if error]
+    for file, error in failed:
+        log.log(f"Failed: {file}: {error}")
+    if failed:
+        log.log(f"{len(failed)} of {len(file_names)} files failed.")
+        return 1
+    return 1 if annotation_failed else 0
@@ -0,0 +1,99 @@
+import os
+import json
+import fcntl
+import hashlib
+import threading
+
+import pandas as pd
+
+class Manifest:
+    """ A record of the completed stages of a pipeline run, for resuming an interrupted or repeated run.
+
+    Each entry is a stage (e.g. 'ld') of a locus (or of the whole input file), with a key
+    hashing its inputs and parameters, and its output files with their sizes and modification
+    times. A stage is done if its key is unchanged and its outputs have not changed since they were
+    recorded; it is then skipped. With resume False, nothing is skipped, but stages are still recorded.
+
+    The manifest is a JSON file, shared (with a file lock) by all threads and processes.
+    Manifests can be pickled, e.g. to send credible sets to the annotation stage.
+    """
+    def __init__(self, file, resume=True):
+        self.file = file
+        self.resume = resume
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _locked(self):
+        """ Return an open lock file, held exclusively. """
+        lock_file = open(self.file + ".lock", "w")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _read(self):
+        try:
+            with open(self.file) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def done(self, stage, name, key):
+        """ Return True if stage has been done for name (a locus, or the input file) with this key. """
+        if not self.resume:
+            return False
+        with self._lock, self._locked():
+            entry = self._read().get(f"{stage}/{name}")
+        if entry is None or entry['key'] != key:
+            return False
+        for file, stamp in entry['outputs'].items():
+            if not os.path.exists(file) or file_stamp(file) != stamp:
+                return False
+        with self._lock:
+            self.skipped += 1
+        return True
+
+    def record(self, stage, name, key, outputs):
+        """ Record that stage has been done for name with this key, making the output files. """
+        with self._lock, self._locked():
+            entries = self._read()
+            entries[f"{stage}/{name}"] = {'key': key, 'outputs': {file: file_stamp(file) for file in outputs}}
+            tmp = f"{self.file}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(entries, f, indent=1)
+            os.replace(tmp, self.file)
+
+def file_stamp(file):
+    """ Return the size and modification time of a file. """
+    st = os.stat(file)
+    return [st.st_size, st.st_mtime_ns]
+
+def key(*parts):
+    """ Hash the inputs of a stage: dataframes (by content), bytes, or anything with a str (e.g. parameters). """
+    sha = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, pd.DataFrame):
+            sha.update(json.dumps([str(col) for col in part.columns]).encode())
+            sha.update(pd.util.hash_pandas_object(part, index=False).values.tobytes())
+        elif isinstance(part, bytes):
+            sha.update(part)
+        else:
+            sha.update(json.dumps(part, default=str).encode())
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+def file_key(file):
+    """ Hash a file's content. """
+    with open(file, "rb") as f:
+        return key(f.read())
+
+def stamps(files):
+    """ Return the absolute paths, sizes and modification times of files, e.g. to key a stage on its input files. """
+    return [[os.path.abspath(file)] + file_stamp(file) for file in files]
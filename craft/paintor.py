@@ -6,21 +6,29 @@ import pandas as pd
 import numpy as np
 
 import craft.config as config
+import craft.ldstore as ldstore
+import craft.tools as tools
 
-def paintor(data_dfs, index_df):
+def paintor(data_dfs, index_df, file_dir, ld_workers=None, ld_threads=1, ld_cache=None, ld_mode='locus', manifest=None):
     """ Runs PAINTOR V3.0 on summary statistics.
 
     Usage information available at the PAINTOR wiki. https://github.com/gkichaev/PAINTOR_V3.0/wiki/2.-Input-Files-and-Formats
 
     The CRAFT pipeline does not implement visualisation with CANVIS (as this requires Python 2.7, which is near end-of-life.)
+
+    LD matrices are made as for FINEMAP (see craft.ldstore.ld_matrices), sharing its ld_cache,
+    and are kept from an earlier run if recorded in manifest. PAINTOR itself runs on all loci at once.
+    Its input and output files are kept in file_dir/paintor_input, so files run at once (see --jobs) do not share them.
     """
     with tempfile.TemporaryDirectory() as tempdir:
-        tempdir = "output/paintor_input/"
+        paintor_dir = os.path.join(file_dir, "paintor_input", "") # PAINTOR appends file names to -in and -out
+        os.makedirs(paintor_dir, exist_ok=True)
 
-        ld_store_executable = os.path.join(config.ldstore_dir, "ldstore")
-        input_file_loc = os.path.join(tempdir, "input_file")
+        input_file_loc = os.path.join(paintor_dir, "input_file")
         input_file = open(f"{input_file_loc}", "w")
 
+        ld_jobs = []
+
         # need to take in index_df region definitions.
         index_count = 0
 
@@ -29,13 +37,13 @@ def paintor(data_dfs, index_df):
             chr = index_df.at[index_count, 'chromosome']
             index = index_df.at[index_count, 'rsid']
 
-            # set filenames in tempdir with index SNP rsid (as unique identifier for input and output files)
-            locus_file = os.path.join(tempdir, index)
-            variant_file = os.path.join(tempdir, index + "_variant.txt")
+            # set filenames in paintor_dir (bcor files in tempdir) with index SNP rsid (as unique identifier for input and output files)
+            locus_file = os.path.join(paintor_dir, index)
+            variant_file = os.path.join(paintor_dir, index + "_variant.txt")
             plink_basename = os.path.join(config.plink_basename_dir, f"chr{chr}_ld_panel")
             bcor_file = os.path.join(tempdir, index + ".bcor")
-            ld_file = os.path.join(tempdir, index + ".ld")
-            annotation_file = os.path.join(tempdir, index + ".annotations")
+            ld_file = os.path.join(paintor_dir, index + ".ld")
+            annotation_file = os.path.join(paintor_dir, index + ".annotations")
 
             # define region size [need to give index df as well and identify matching row based on rsid]
             region_start_cm = index_df.at[index_count, 'region_start_cm']
@@ -53,13 +61,10 @@ def paintor(data_dfs, index_df):
             variants = data[['rsid','position','chromosome','allele1','allele2']]
             variants.to_csv(variant_file, sep=' ', index=False, header=['RSID','position','chromosome','A_allele','B_allele'], float_format='%g')
 
-            # make an LD file (bcor)
-            cmd = (ld_store_executable + " --bplink " + plink_basename + f" --bcor {bcor_file} --incl-range {region_start_cm}-{region_end_cm} --n-threads 1")
-            os.system(cmd)
-
-            # make an LD file matrix for our rsids in locus (matrix)
-            cmd = (ld_store_executable + f" --bcor {bcor_file}_1 --matrix {ld_file} --incl-variants {variant_file}")
-            os.system(cmd)
+            # queue LD file (bcor, then matrix) generation for this locus
+            ld_jobs.append(dict(plink_basename=plink_basename,
+                                region_start=region_start_cm, region_end=region_end_cm,
+                                variant_file=variant_file, bcor_file=bcor_file, ld_file=ld_file))
 
             # Make an annotation file (all rows 0 to show 'no annotation')
             # Annotation library (large, 6.7GB download) is available from PAINTOR and may be implemented in future versions of this pipeline
@@ -75,10 +80,13 @@ def paintor(data_dfs, index_df):
         # Write completed input file out for use
         input_file.close()
 
-        # run paintor (tell it data files are in temp directory)
-        # may wish to add command line option for specifying max causal and enumerate [number of causals]
-        cmd = (f"{config.paintor_dir}" + "/PAINTOR " + f" -input {input_file_loc} -Zhead ZSCORE -LDname ld -in {tempdir} -out {tempdir} -max_causal 2 -enumerate 2 -annotations dummy_annotation")
+        # make LD files for all loci concurrently
+        ldstore.ld_matrices(ld_jobs, ld_workers, ld_threads, ld_cache, ld_mode, manifest=manifest)
 
-        os.system(cmd)
+        # run paintor (tell it data files are in paintor_dir)
+        # may wish to add command line option for specifying max causal and enumerate [number of causals]
+        cmd = [os.path.join(config.paintor_dir, "PAINTOR"), "-input", input_file_loc, "-Zhead", "ZSCORE", "-LDname", "ld",
+               "-in", paintor_dir, "-out", paintor_dir, "-max_causal", 2, "-enumerate", 2, "-annotations", "dummy_annotation"]
+        tools.run(cmd, "paintor")
 
     return 0
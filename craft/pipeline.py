@@ -0,0 +1,43 @@
+import queue
+import threading
+
+class BatchStage:
+    """ Run a pipeline stage in a background thread, on items as they are submitted.
+
+    function is called with a list of items: every item submitted since its previous call.
+    Items submitted while it runs (e.g. credible sets of loci that finish FINEMAP during an
+    ANNOVAR run) are batched into the next call, so a stage that is costly to start is
+    started as few times as possible, while still overlapping with the stages feeding it.
+    """
+    def __init__(self, function):
+        self.function = function
+        self.error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, items):
+        """ Queue a list of items; safe to call from any thread. """
+        for item in items:
+            self._queue.put((False, item))
+
+    def _run(self):
+        done = False
+        while not done:
+            batch = [self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get())
+            done = any(stop for stop, item in batch)
+            items = [item for stop, item in batch if not stop]
+            if items and self.error is None:
+                try:
+                    self.function(items)
+                except (Exception, SystemExit) as e:
+                    self.error = e
+
+    def close(self):
+        """ Wait for all submitted items to be processed; raises the first error of the stage, if any. """
+        self._queue.put((True, None))
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
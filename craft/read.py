@@ -1,79 +1,418 @@
 import glob
+import hashlib
+import json
 import os
+import re
+from collections.abc import Mapping
 
 import pandas as pd
 import numpy as np
 
-def snptest(file):
-    """ Read snptest data into an internal dataframe. """
+import craft.config as config
+
+def snptest(file, alpha=None, region_bounds=None, chunksize=1000000):
+    """ Read snptest data into an internal dataframe.
+
+    If alpha and region_bounds are given, only SNPs near significant SNPs are kept (see summary_stats).
+    """
     cols = ['chromosome','alleleA','alleleB','rsid','position','all_total', 'cases_total','controls_total','all_maf','frequentist_add_pvalue',
     'frequentist_add_beta_1', 'frequentist_add_se_1']
-    df = pd.read_csv(file, sep=' ', comment='#')[cols]
+    df = summary_stats(file, dict(sep=' ', comment='#'), ['chromosome', 'position', 'frequentist_add_pvalue'],
+                       alpha, region_bounds, chunksize)[cols]
     df.rename(columns={'all_maf':'maf','frequentist_add_pvalue':'pvalue', 'frequentist_add_beta_1':'beta', 'frequentist_add_se_1':'se','alleleA':'allele1','alleleB':'allele2'}, inplace=True)
     return df
 
-def plink(file, frq_file):
-    """ Read plink (.assoc.logistic) data into an internal dataframe. """
-    # read .assoc.logistic file
+def plink(file, frq_file, alpha=None, region_bounds=None, chunksize=1000000):
+    """ Read plink (.assoc.logistic) data into an internal dataframe.
+
+    Only the needed columns are read, with explicit dtypes (alleles as categories), and
+    .frq.cc rows are joined on rsid through a hash index. frq_file is either a .frq.cc file
+    name or, to avoid re-reading it for every input file, its partitions (see frq_cc and FrqCC).
+
+    If alpha and region_bounds are given, only SNPs near significant SNPs are kept (see summary_stats).
+    """
+    # read .assoc.logistic file (space-padded columns, so split on single spaces skipping the padding)
     cols = ['CHR','A1','SNP','BP','P','SE','OR']
-    df = pd.read_csv(file, sep='\s+')[cols]
+    dtypes = {'CHR': np.int64, 'A1': 'category', 'SNP': str, 'BP': np.int64, 'P': np.float64, 'SE': np.float64, 'OR': np.float64}
+    df = summary_stats(file, dict(sep=' ', skipinitialspace=True, usecols=cols, dtype=dtypes), ['CHR', 'BP', 'P'], alpha, region_bounds, chunksize)
     df.rename(columns={'CHR':'chromosome','SNP':'rsid','BP':'position','A1':'allele1','P':'pvalue','SE':'se'}, inplace=True)
     # For finemap, we need the beta coefficient. For a binary logistic regression, ln(OR) = beta coefficient.
-    for index, row in df.iterrows():
-        df['beta'] = np.log(df['OR'])
-    df.drop(columns='OR')
-
-    # read .frq.cc file
-    cols = ['CHR','SNP','A2','MAF_A','MAF_U','NCHROBS_A', 'NCHROBS_U']
-    frq_df = pd.read_csv(frq_file, sep='\s+')[cols]
-    # takes MAF_U as reflects 'unaffected' population controls, unless MAF_U > 0.5, in which case it uses MAF_A
-    frq_df.rename(columns={'CHR':'chromosome','SNP':'rsid','A2':'allele2','MAF_U':'maf','NCHROBS_A':'cases_total','NCHROBS_U':'controls_total'}, inplace=True)
-    frq_df['maf'].values[frq_df['maf'] > 0.5] = 0.5
-    # if chromosome column has more than 1 number, read chromosome number from .assoc.logistic file and only include rows with that value.
-    chromosomes = df.chromosome.unique()
-    frq_df = frq_df[frq_df['chromosome'].isin(chromosomes)]
-    frq_df = frq_df.drop(columns={"chromosome", "MAF_A"}, axis=1)
-    # create an all_total column
-    for index, row in frq_df.iterrows():
-        frq_df['all_total'] = frq_df['cases_total'] + frq_df['controls_total']
-    # merge based on rsid
-    df = pd.merge(df, frq_df, how='inner',on='rsid')
+    df['beta'] = np.log(df['OR'].values)
+
+    # .frq.cc rows for the chromosome(s) in the .assoc.logistic file
+    if not isinstance(frq_file, Mapping):
+        frq_file = frq_cc(frq_file)
+    parts = [frq_file[chromosome] for chromosome in df.chromosome.unique() if chromosome in frq_file]
+    if parts:
+        frq_df = pd.concat(parts)
+    else:
+        frq_df = pd.DataFrame(columns=frq_cols, index=pd.Index([], name='rsid'))
+
+    # join on rsid (an inner join, in .assoc.logistic order)
+    if frq_df.index.is_unique:
+        rows = frq_df.index.get_indexer(df['rsid'])
+        df = df[rows >= 0].reset_index(drop=True)
+        frq_rows = frq_df.iloc[rows[rows >= 0]].reset_index(drop=True)
+        df = pd.concat([df, frq_rows], axis=1)
+    else:
+        df = pd.merge(df, frq_df.reset_index(), how='inner', on='rsid')
     # Rearrange column order after merge to match SNPtest format
     order = ['chromosome','allele1','allele2','rsid','position','all_total', 'cases_total','controls_total','maf','pvalue', 'beta', 'se']
     df = df[order]
     return df
 
-def csv(file):
-    """Read csv data into an internal dataframe. """
+# .frq.cc columns joined to plink data
+frq_cols = ['allele2','all_total','cases_total','controls_total','maf']
+
+def frq_cc(frq_file):
+    """ Read a plink .frq.cc file into a dictionary of dataframes indexed by rsid, one per chromosome.
+
+    Reading it once lets each per-chromosome .assoc.logistic file join only its own partition.
+    """
+    cols = ['CHR','SNP','A2','MAF_U','NCHROBS_A', 'NCHROBS_U']
+    dtypes = {'CHR': np.int64, 'SNP': str, 'A2': 'category', 'MAF_U': np.float64, 'NCHROBS_A': np.int64, 'NCHROBS_U': np.int64}
+    frq_df = pd.read_csv(frq_file, sep=' ', skipinitialspace=True, usecols=cols, dtype=dtypes)
+    # takes MAF_U as reflects 'unaffected' population controls, capped at 0.5
+    frq_df.rename(columns={'CHR':'chromosome','SNP':'rsid','A2':'allele2','MAF_U':'maf','NCHROBS_A':'cases_total','NCHROBS_U':'controls_total'}, inplace=True)
+    frq_df['maf'] = np.minimum(frq_df['maf'].values, 0.5)
+    # create an all_total column
+    frq_df['all_total'] = frq_df['cases_total'].values + frq_df['controls_total'].values
+    frq_df = frq_df.set_index('rsid')
+    return {chromosome: part[frq_cols] for chromosome, part in frq_df.groupby('chromosome', sort=False)}
+
+class FrqCC(Mapping):
+    """ A plink .frq.cc file, partitioned by chromosome (see frq_cc), read only when first used.
+
+    Runs whose summary statistics all come from the cache (see cached) never read it. With cache_dir,
+    the partitions are also saved there, and loaded instead of parsing the file again until it
+    changes (size or modification time); with several worker processes, they are saved before the
+    workers start (see save), so that each loads them rather than parsing the file.
+    """
+    def __init__(self, frq_file, cache_dir=None):
+        self.frq_file = frq_file
+        self.cache_dir = cache_dir
+        self.parts = None
+
+    def __getitem__(self, chromosome):
+        return self.load()[chromosome]
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+    def load(self):
+        """ Return the partitions, reading them if not done yet. """
+        if self.parts is None:
+            self.parts = self.save(load=True) if self.cache_dir else frq_cc(self.frq_file)
+        return self.parts
+
+    def save(self, load=False):
+        """ Make sure the partitions are saved in cache_dir, reading the file only if they are not saved from it as it is now.
+
+        Run before starting worker processes, so that each loads the saved partitions rather than reading the file.
+        If load is set, the partitions are also returned.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        name = json.dumps(['frq_cc', os.path.abspath(self.frq_file)])
+        cache_file = os.path.join(self.cache_dir, hashlib.sha256(name.encode()).hexdigest() + '.npz')
+        stamp = json.dumps([os.path.getsize(self.frq_file), os.stat(self.frq_file).st_mtime_ns])
+        try:
+            if load_dfs(cache_file, ['meta'])['meta'].stamp.iloc[0] == stamp:
+                if not load:
+                    return None
+                dfs = load_dfs(cache_file)
+                del dfs['meta']
+                return {int(chromosome): part for chromosome, part in dfs.items()}
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            pass
+        parts = frq_cc(self.frq_file)
+        dfs = {str(chromosome): part for chromosome, part in parts.items()}
+        dfs['meta'] = pd.DataFrame({'stamp': [stamp]})
+        save_dfs(cache_file, dfs)
+        return parts if load else None
+
+def csv(file, alpha=None, region_bounds=None, chunksize=1000000):
+    """Read csv data into an internal dataframe.
+
+    If alpha and region_bounds are given, only SNPs near significant SNPs are kept (see summary_stats).
+    """
     cols = ['chromosome','allele1','allele2','rsid','position','all_total', 'cases_total','controls_total','maf','pvalue', 'beta', 'se']
-    df = pd.read_csv(file, sep='\t')[cols]
+    df = summary_stats(file, dict(sep='\t'), ['chromosome', 'position', 'pvalue'], alpha, region_bounds, chunksize)[cols]
     return df
 
-def maps(source_dir):
-    """ Read genetic map data into a maps object. """
-    map_file_list = glob.glob(source_dir + '/*chr[0-9]*.txt')
-    maps = {}
-    for file in map_file_list:
-        map_file = pd.read_csv(file, sep='\t')
-        chromosome = map_file['Chromosome'].ix[0].strip('chr')
-        maps[chromosome] = map_file
-    return maps
-
-def annovar(file, file_exonic, colnames):
+def summary_stats(file, csv_args, key_cols, alpha=None, region_bounds=None, chunksize=1000000):
+    """ Read a summary statistics file into a dataframe, optionally keeping only SNPs near significant SNPs.
+
+    csv_args are passed to pd.read_csv; key_cols are the file's chromosome, position and p value column names.
+
+    Without alpha and region_bounds, the whole file is read. Otherwise the file is streamed
+    twice, chunksize rows at a time, so that memory scales with the number of loci rather than
+    the file size. The first pass reads only the key columns and finds the region around every
+    SNP with p <= alpha: region_bounds is given a dataframe of their chromosome and position and
+    returns (start, end) arrays. The second pass keeps only the rows within any of those regions.
+    Every possible locus lies within these regions, so later steps give the same results.
+    """
+    if alpha is None or region_bounds is None:
+        return pd.read_csv(file, **csv_args)
+
+    # first pass: regions around significant SNPs
+    chromosome, position, pvalue = key_cols
+    first_pass_args = dict(csv_args, usecols=key_cols)
+    first_pass_args.pop('dtype', None)
+    significant = [chunk[chunk[pvalue] <= alpha]
+                   for chunk in pd.read_csv(file, chunksize=chunksize, **first_pass_args)]
+    significant = pd.concat(significant).rename(columns={chromosome: 'chromosome', position: 'position'})
+    region_start, region_end = region_bounds(significant)
+
+    # merge the regions into sorted, disjoint intervals (by position only, as for locus SNPs)
+    order = np.argsort(region_start, kind='stable')
+    region_start, region_end = np.asarray(region_start)[order], np.asarray(region_end)[order]
+    region_end = np.maximum.accumulate(region_end) if len(region_end) else region_end
+    new = np.ones(len(region_start), dtype=bool)
+    new[1:] = region_start[1:] > region_end[:-1]
+    starts = region_start[new]
+    ends = np.append(region_end[np.flatnonzero(new)[1:] - 1], region_end[-1:])
+
+    # second pass: keep rows within the intervals
+    kept = []
+    for chunk in pd.read_csv(file, chunksize=chunksize, **csv_args):
+        positions = chunk[position].values
+        interval = np.searchsorted(starts, positions, side='right') - 1
+        keep = (interval >= 0) & (positions <= ends[interval.clip(0)]) if len(starts) else np.zeros(len(chunk), dtype=bool)
+        kept.append(chunk[keep])
+    df = pd.concat(kept, ignore_index=True)
+    # chunks have their own categories, so concat may have lost categorical columns
+    for col, dtype in csv_args.get('dtype', {}).items():
+        if dtype == 'category' and col in df:
+            df[col] = df[col].astype('category')
+    return df
+
+def compact(df):
+    """ Return an internal dataframe with a compact memory schema.
+
+    maf, beta and se become float32 (p values stay float64, as they can be far smaller than
+    float32 allows); position and (whole-number) sample counts become int32; chromosome and
+    alleles, with few distinct values, become categories; rsid and index_rsid, mostly distinct,
+    become Arrow-backed strings (one buffer of characters and offsets, rather than a Python
+    object per row, or a category per rsid). Other columns (e.g. ABF, pp) are unchanged.
+    """
+    df = df.copy()
+    for col in ['maf', 'beta', 'se']:
+        if col in df and pd.api.types.is_float_dtype(df[col]):
+            df[col] = df[col].astype(np.float32)
+    for col in ['position', 'all_total', 'cases_total', 'controls_total']:
+        if col in df and pd.api.types.is_numeric_dtype(df[col]):
+            values = df[col].values
+            if np.array_equal(values, np.round(values)):
+                df[col] = values.astype(np.int32)
+            elif pd.api.types.is_float_dtype(df[col]):
+                df[col] = values.astype(np.float32)
+    for col in ['chromosome', 'allele1', 'allele2']:
+        if col in df and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    for col in ['rsid', 'index_rsid']:
+        if col in df:
+            df[col] = df[col].astype(pd.StringDtype('pyarrow', na_value=np.nan))
+    return df
+
+def cached(cache_dir, files, reader, *args):
+    """ Read summary statistics with reader(*args), using a columnar cache in cache_dir.
+
+    files are the input file names. The internal dataframe is stored as a NumPy .npz file
+    (one array per column), named by the reader and the input file paths. It is rebuilt whenever any input file changes
+    (size or modification time); otherwise it is loaded instead of parsing the text files.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    name = json.dumps([reader.__name__] + [os.path.abspath(file) for file in files])
+    cache_file = os.path.join(cache_dir, hashlib.sha256(name.encode()).hexdigest() + '.npz')
+    stamp = json.dumps([[os.path.getsize(file), os.stat(file).st_mtime_ns] for file in files])
+    try:
+        with np.load(cache_file, allow_pickle=False) as npz:
+            meta = json.loads(str(npz['_meta']))
+            if meta['stamp'] == stamp:
+                return columns_df(npz, meta['columns'])
+    except (FileNotFoundError, KeyError, ValueError, OSError):
+        pass
+
+    df = reader(*args)
+    arrays, columns = df_columns(df)
+    arrays['_meta'] = np.array(json.dumps({'stamp': stamp, 'columns': columns}))
+    tmp = f"{cache_file}.{os.getpid()}.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, cache_file)
+    return df
+
+def save_dfs(file, dfs):
+    """ Save a dictionary of named dataframes, with their row indexes, to one .npz file (see df_columns). """
+    arrays = {}
+    meta = {}
+    for name, df in dfs.items():
+        df_arrays, columns = df_columns(df.reset_index(names='_index'))
+        arrays.update({f"{name}.{array}": values for array, values in df_arrays.items()})
+        meta[name] = {'columns': columns, 'index_name': df.index.name}
+    arrays['_meta'] = np.array(json.dumps(meta))
+    tmp = f"{file}.{os.getpid()}.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, file)
+
+def load_dfs(file, names=None):
+    """ Load a dictionary of named dataframes saved by save_dfs (only those in names, if given). """
+    dfs = {}
+    with np.load(file, allow_pickle=False) as npz:
+        meta = json.loads(str(npz['_meta']))
+        for name, df_meta in meta.items():
+            if names is not None and name not in names:
+                continue
+            arrays = {array[len(name) + 1:]: npz[array] for array in npz.files if array.startswith(name + '.')}
+            df = columns_df(arrays, df_meta['columns']).set_index('_index')
+            dfs[name] = df.rename_axis(df_meta['index_name'])
+    return dfs
+
+def df_columns(df):
+    """ Convert a dataframe to a dictionary of plain (non-object) NumPy arrays and a column list.
+
+    String columns are stored as unicode arrays, with a mask of missing values. Categorical columns
+    are stored as their codes, with their categories stored (keeping their dtype) as a column of their own.
+    """
+    arrays = {}
+    columns = [[col] + column_arrays(arrays, f'c{i}', df[col]) for i, col in enumerate(df.columns)]
+    return arrays, columns
+
+def column_arrays(arrays, key, values):
+    """ Store a column in arrays under key (see df_columns), and return its description for column_values. """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        arrays[key] = values.cat.codes.values
+        categories = column_arrays(arrays, f'{key}_categories', pd.Series(values.cat.categories))
+        return ['category', False, categories + [bool(values.cat.ordered)]]
+    if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+        arrays[key] = values.values
+        return [str(values.dtype), False]
+    arrays[key] = np.array(values.fillna('').astype(str).tolist(), dtype=str)
+    arrays[f'{key}_na'] = values.isna().values
+    return [str(values.dtype), True]
+
+def column_values(arrays, key, dtype, strings, categories=None):
+    """ Rebuild a column stored by column_arrays. """
+    values = arrays[key]
+    if categories:
+        *categories, ordered = categories
+        return pd.Categorical.from_codes(values, column_values(arrays, f'{key}_categories', *categories), ordered=ordered)
+    if strings:
+        values = values.astype(object)
+        values[arrays[f'{key}_na']] = np.nan
+        values = pd.Series(values, dtype=dtype)
+    return values
+
+def columns_df(arrays, columns):
+    """ Rebuild a dataframe stored by df_columns. """
+    return pd.DataFrame({col: column_values(arrays, f'c{i}', *column) for i, (col, *column) in enumerate(columns)})
+
+class GeneticMaps(Mapping):
+    """ Genetic maps, keyed by chromosome ('1', '2', ...), loaded only when used.
+
+    Each genetic map text file is compiled once to NumPy position and cM arrays in
+    compiled_dir, which are then memory-mapped. A map is recompiled when its text file
+    changes (size or modification time). Each map is returned as a dataframe with
+    'Position(bp)' and 'Map(cM)' columns backed by the memory-mapped arrays.
+    """
+    def __init__(self, source_dir, compiled_dir):
+        self.source_dir = source_dir
+        self.compiled_dir = compiled_dir
+        self.files = {}
+        for file in glob.glob(source_dir + '/*chr[0-9]*.txt'):
+            chromosome = re.search('chr([0-9]+)', os.path.basename(file)).group(1)
+            self.files[chromosome] = file
+        self.loaded = {}
+
+    def __getstate__(self):
+        # don't pickle loaded maps; each process memory-maps its own
+        state = self.__dict__.copy()
+        state['loaded'] = {}
+        return state
+
+    def __getitem__(self, chromosome):
+        chromosome = str(chromosome)
+        if chromosome not in self.loaded:
+            position, cm = self.arrays(chromosome)
+            self.loaded[chromosome] = pd.DataFrame({'Position(bp)': position, 'Map(cM)': cm}, copy=False)
+        return self.loaded[chromosome]
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def arrays(self, chromosome):
+        """ Return memory-mapped (position, cM) arrays for a chromosome, compiling them if needed. """
+        file = self.files[str(chromosome)]
+        base = os.path.join(self.compiled_dir, os.path.splitext(os.path.basename(file))[0])
+        stamp = {'size': os.path.getsize(file), 'mtime': os.stat(file).st_mtime_ns}
+        try:
+            with open(base + '.json') as f:
+                compiled = json.load(f) == stamp
+        except (FileNotFoundError, ValueError):
+            compiled = False
+        if not compiled:
+            self.compile(file, base, stamp)
+        return (np.load(base + '.position.npy', mmap_mode='r'),
+                np.load(base + '.cm.npy', mmap_mode='r'))
+
+    def compile(self, file, base, stamp):
+        """ Compile a genetic map text file to NumPy arrays. """
+        os.makedirs(self.compiled_dir, exist_ok=True)
+        map_file = pd.read_csv(file, sep='\t', usecols=['Position(bp)', 'Map(cM)'])
+        # write to temporary files first, as other processes may be reading the old arrays
+        pid = os.getpid()
+        for name, values in [('position', map_file['Position(bp)'].values.astype(np.int64)),
+                             ('cm', map_file['Map(cM)'].values.astype(np.float64))]:
+            np.save(f"{base}.{name}.{pid}.npy", values)
+            os.replace(f"{base}.{name}.{pid}.npy", f"{base}.{name}.npy")
+        with open(f"{base}.{pid}.json", 'w') as f:
+            json.dump(stamp, f)
+        os.replace(f"{base}.{pid}.json", base + '.json')
+
+def maps(source_dir, compiled_dir=None):
+    """ Read genetic map data into a maps object.
+
+    Maps are compiled to compiled_dir (by default, config.genetic_map_compiled_dir within
+    source_dir) and only loaded for the chromosomes actually used; see GeneticMaps.
+    """
+    if compiled_dir is None:
+        compiled_dir = os.path.join(source_dir, config.genetic_map_compiled_dir)
+    return GeneticMaps(source_dir, compiled_dir)
+
+def annovar(file, file_exonic, colnames, on=['rsid']):
     """ Read ANNOVAR output files into an internal dataframe.
 
     Gene annotation with ANNOVAR returns two different output files (variant_function and exonic_variant_function).
 
-    Where exonic SNPs exist, we merge the additional data of exonic variant function, and genes + transcript ID + protein-level change into the dataframe based on matching rsids.
+    Where exonic SNPs exist, we merge the additional data of exonic variant function, and genes + transcript ID + protein-level change into the dataframe based on matching rsids
+    (or the columns in on).
     """
     df = pd.DataFrame(columns=colnames)
     if os.path.getsize(file) != 0: #ANNOVAR may have returned an empty file!
-        df = df.append(pd.read_csv(file, sep='\t', names = colnames))
+        df = pd.read_csv(file, sep='\t', names = colnames)
     if os.path.getsize(file_exonic) != 0:
         df2 = pd.read_csv(file_exonic, sep='\t', names = colnames, usecols=range(1,(len(colnames) + 1))) #exonic file has an extra column on LHS. Throw away column 0!
-        df2 = df2.filter(items=['var_effect','genes','rsid'], axis=1)
+        df2 = df2.filter(items=['var_effect','genes'] + on, axis=1)
         df2.rename(columns={'var_effect':'exonic_variant_function', 'genes':'genes_transcriptID'}, inplace=True)
-        df = pd.merge(df, df2, how='left',on='rsid')
+        df = pd.merge(df, df2, how='left',on=on)
+    return df
+
+def refgene(file):
+    """ Read an ANNOVAR/UCSC refGene table (e.g. humandb/hg19_refGene.txt) into a dataframe of transcripts.
+
+    Chromosome names lose any 'chr' prefix, and exonStarts/exonEnds are kept as comma-separated strings.
+    """
+    cols = ['bin','name','chromosome','strand','txStart','txEnd','cdsStart','cdsEnd','exonCount','exonStarts','exonEnds',
+            'score','name2','cdsStartStat','cdsEndStat','exonFrames']
+    dtypes = {'name': str, 'chromosome': str, 'strand': str, 'txStart': np.int64, 'txEnd': np.int64,
+              'cdsStart': np.int64, 'cdsEnd': np.int64, 'exonStarts': str, 'exonEnds': str, 'name2': str}
+    df = pd.read_csv(file, sep='\t', names=cols, usecols=list(dtypes), dtype=dtypes)
+    df['chromosome'] = df['chromosome'].str.replace('^chr', '', regex=True)
     return df
 
 def index(file):
@@ -98,6 +437,19 @@ def finemap_cred(file):
         cred_dfs.append(cred_df)
     return cred_dfs
 
+def write_cred(cred_file, rsids, sets):
+    """ Write credible sets, side by side, to a .cred file in the layout of FINEMAP v1.3.1 (see finemap_cred).
+
+    sets is a list of (SNPs, probabilities) pairs, SNPs being indices into rsids.
+    """
+    with open(cred_file, 'w') as f:
+        f.write('index ' + ''.join(f'cred{i} prob{i} ' for i in range(1, len(sets) + 1)) + '\n')
+        for row in range(max((len(snps) for snps, probs in sets), default=0)):
+            f.write(f'{row + 1} ')
+            for snps, probs in sets:
+                f.write(f'{rsids[snps[row]]} {probs[row]:g} ' if row < len(snps) else 'NA NA ')
+            f.write('\n')
+
 def cred_annotated(file):
     """Read CRAFT .cred.annotated file into a dataframe."""
     cred_df = pd.read_csv(file, sep='\t')
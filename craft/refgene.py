@@ -0,0 +1,153 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import craft.read as read
+
+# ANNOVAR defaults: distance from a transcript counted as upstream/downstream, and from an exon counted as splicing
+neargene = 1000
+splicing_threshold = 2
+
+# Variant effects with ANNOVAR's precedence (lower first); effects of equal precedence are reported together, e.g. UTR5;UTR3
+effects = np.array(['exonic', 'splicing', 'ncRNA_exonic', 'ncRNA_splicing', 'ncRNA_intronic',
+                    'UTR5', 'UTR3', 'intronic', 'upstream', 'downstream'])
+precedence = np.array([0, 0, 1, 1, 2, 3, 3, 4, 5, 5])
+EXONIC, SPLICING, NCRNA_EXONIC, NCRNA_SPLICING, NCRNA_INTRONIC, UTR5, UTR3, INTRONIC, UPSTREAM, DOWNSTREAM = range(len(effects))
+
+class RefGene:
+    """ An in-process gene-based annotator, giving the var_effect and genes columns of ANNOVAR's -geneanno.
+
+    The refGene table (e.g. annovar/humandb/hg19_refGene.txt) is read once into sorted NumPy arrays per
+    chromosome: transcripts sorted by start, and exons keyed by (transcript, start). Variants are matched to
+    transcripts by binary search, so whole dataframes are annotated without running annotate_variation.pl.
+
+    Variants are treated as single positions, and the splicing and exonic_variant_function details that
+    ANNOVAR derives from transcript sequences are not given. Splicing is only called at intronic positions
+    within splicing_threshold of an exon, so variants on the exonic side of a splice junction may be annotated
+    differently from ANNOVAR. The annotator has not been validated against annotate_variation.pl (see
+    test/annotation/compare_annovar.py), so it is an approximation of ANNOVAR, not a replacement for it.
+    """
+    def __init__(self, file):
+        df = read.refgene(file)
+        self.chromosomes = {chromosome: self._index(tx) for chromosome, tx in df.groupby('chromosome', sort=False)}
+
+    def _index(self, tx):
+        """ Make the arrays of one chromosome's transcripts. """
+        tx = tx.sort_values('txStart', kind='stable')
+        exon_starts = [np.array(s.rstrip(',').split(','), dtype=np.int64) for s in tx.exonStarts]
+        exon_ends = [np.array(s.rstrip(',').split(','), dtype=np.int64) for s in tx.exonEnds]
+        exon_tx = np.repeat(np.arange(len(tx), dtype=np.int64), [len(s) for s in exon_starts])
+        index = {
+            'tx_start': tx.txStart.values, 'tx_end': tx.txEnd.values,
+            'cds_start': tx.cdsStart.values, 'cds_end': tx.cdsEnd.values,
+            'minus': (tx.strand == '-').values, 'gene': tx.name2.values,
+            'max_length': int((tx.txEnd - tx.txStart).max()),
+            # exons sorted by transcript then start, searchable by (transcript << 32) + position
+            'exon_key': (exon_tx << 32) + np.concatenate(exon_starts),
+            'exon_start': np.concatenate(exon_starts), 'exon_end': np.concatenate(exon_ends),
+        }
+        # transcripts sorted by end, for the nearest gene to the left of intergenic variants
+        index['by_end'] = np.argsort(index['tx_end'], kind='stable')
+        index['sorted_end'] = index['tx_end'][index['by_end']]
+        return index
+
+    def annotate(self, df):
+        """ Return a copy of a dataframe with chromosome and position columns, with var_effect and genes columns first. """
+        var_effect, genes = self.effects(df.chromosome.values, df.position.values)
+        df = df.copy()
+        df.insert(0, 'genes', genes)
+        df.insert(0, 'var_effect', var_effect)
+        return df
+
+    def effects(self, chromosomes, positions):
+        """ Return arrays of var_effect and genes for arrays of chromosomes and (1-based) positions. """
+        chromosomes = pd.Series(chromosomes).astype(str).str.replace('^chr', '', regex=True).values
+        positions = np.asarray(positions, dtype=np.int64)
+        var_effect = np.empty(len(positions), dtype=object)
+        genes = np.empty(len(positions), dtype=object)
+        for chromosome in pd.unique(chromosomes):
+            rows = np.flatnonzero(chromosomes == chromosome)
+            index = self.chromosomes.get(chromosome)
+            if index is None:
+                var_effect[rows], genes[rows] = 'intergenic', 'NONE(dist=NONE),NONE(dist=NONE)'
+            else:
+                var_effect[rows], genes[rows] = self._effects(index, positions[rows])
+        return var_effect, genes
+
+    def _effects(self, index, p):
+        """ Annotate positions on one chromosome. """
+        tx_start, tx_end = index['tx_start'], index['tx_end']
+        # candidate (variant, transcript) pairs: transcripts starting up to the longest transcript length before p
+        lo = np.searchsorted(tx_start, p - neargene - index['max_length'], 'left')
+        hi = np.searchsorted(tx_start, p + neargene - 1, 'right')
+        counts = hi - lo
+        v = np.repeat(np.arange(len(p)), counts)
+        t = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+        near = (p[v] > tx_start[t] - neargene) & (p[v] <= tx_end[t] + neargene)
+        v, t = v[near], t[near]
+        pos = p[v]
+
+        # the exon starting at or before each position (txStart is 0-based, so pos > exonStart)
+        k = np.searchsorted(index['exon_key'], (t << 32) + pos - 1, 'right') - 1
+        k_next = np.minimum(k + 1, len(index['exon_key']) - 1)
+        inside = (pos > tx_start[t]) & (pos <= tx_end[t])
+        in_exon = inside & (pos <= index['exon_end'][k])
+        splice = inside & ~in_exon & ((pos - index['exon_end'][k] <= splicing_threshold) |
+                                      (index['exon_start'][k_next] + 1 - pos <= splicing_threshold))
+        noncoding = index['cds_start'][t] == index['cds_end'][t]
+        minus = index['minus'][t]
+        before_cds = pos <= index['cds_start'][t]
+        after_cds = pos > index['cds_end'][t]
+
+        code = np.where(minus, UPSTREAM, DOWNSTREAM)
+        code[pos <= tx_start[t]] = np.where(minus, DOWNSTREAM, UPSTREAM)[pos <= tx_start[t]]
+        code[inside] = np.where(noncoding, NCRNA_INTRONIC, INTRONIC)[inside]
+        code[splice] = np.where(noncoding, NCRNA_SPLICING, SPLICING)[splice]
+        coding_exon = np.where(before_cds, np.where(minus, UTR3, UTR5),
+                               np.where(after_cds, np.where(minus, UTR5, UTR3), EXONIC))
+        code[in_exon] = np.where(noncoding, NCRNA_EXONIC, coding_exon)[in_exon]
+
+        # keep the effects of highest precedence for each variant, with their genes
+        pairs = pd.DataFrame({'v': v, 'code': code, 'precedence': precedence[code], 'gene': index['gene'][t]})
+        pairs = pairs[pairs.precedence == pairs.groupby('v').precedence.transform('min')]
+        pairs = pairs.drop_duplicates(['v', 'code', 'gene']).sort_values(['v', 'code', 'gene'])
+        v, code, gene = pairs.v.values, pairs.code.values, pairs.gene.values
+        var_effect = np.full(len(p), 'intergenic', dtype=object)
+        genes = np.empty(len(p), dtype=object)
+        # most variants have one effect in one gene; the rest are joined as gene1,gene2 and effect1;effect2
+        single = np.bincount(v, minlength=len(p))[v] == 1
+        var_effect[v[single]] = effects[code[single]]
+        genes[v[single]] = gene[single]
+        for variant, rows in itertools.groupby(zip(v[~single], code[~single], gene[~single]), key=lambda row: row[0]):
+            per_effect = [(c, ','.join(g for _, _, g in group)) for c, group in itertools.groupby(rows, key=lambda row: row[1])]
+            var_effect[variant] = ';'.join(effects[c] for c, g in per_effect)
+            genes[variant] = ';'.join(g for c, g in per_effect)
+        intergenic = np.flatnonzero(var_effect == 'intergenic')
+        genes[intergenic] = self._intergenic(index, p[intergenic])
+        return var_effect, genes
+
+    def _intergenic(self, index, p):
+        """ Return the nearest genes on either side of intergenic positions, with distances, as ANNOVAR does. """
+        left = np.searchsorted(index['sorted_end'], p, 'left') - 1
+        right = np.searchsorted(index['tx_start'], p, 'left')
+        genes = []
+        for pos, l, r in zip(p, left, right):
+            if l >= 0:
+                left_gene = f"{index['gene'][index['by_end'][l]]}(dist={pos - index['sorted_end'][l]})"
+            else:
+                left_gene = "NONE(dist=NONE)"
+            if r < len(index['tx_start']):
+                right_gene = f"{index['gene'][r]}(dist={index['tx_start'][r] + 1 - pos})"
+            else:
+                right_gene = "NONE(dist=NONE)"
+            genes.append(f"{left_gene},{right_gene}")
+        return genes
+
+    def annotate_variants(self, variants):
+        """ Annotate a list of (chromosome, start, end, ref, alt) variants, as annotate.annotation_annoVar_variants does. """
+        if not variants:
+            return {}
+        chromosomes, starts = zip(*((variant[0], variant[1]) for variant in variants))
+        var_effect, genes = self.effects(np.array(chromosomes, dtype=object), np.array(starts))
+        return {variant: (effect, gene, None, None) for variant, effect, gene in zip(variants, var_effect, genes)}
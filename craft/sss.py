@@ -0,0 +1,267 @@
+import math
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.linalg import solve_triangular
+from scipy.special import logsumexp
+
+import craft.read as read
+
+class SSS:
+    """ A FINEMAP-style shotgun stochastic search over causal configurations of one locus, in NumPy.
+
+    z is the z-score (beta / se) of each SNP and ld their correlation matrix (as made by LDstore).
+    A configuration is a set of up to max_causal causal SNPs, with the prior of FINEMAP (each SNP
+    causal with probability 1/m) and the Bayes factor of FINEMAP's shotgun stochastic search:
+    with s2 = n_samples * prior_std**2 and R the LD between the causal SNPs,
+
+        log BF = s2/2 z'(I + s2 R)^-1 z - 1/2 log det(I + s2 R)
+
+    The search moves from configuration to configuration, scoring every neighbour (deleting, swapping
+    or adding one SNP) and choosing the next in proportion to its score. Neighbours are scored from the
+    Cholesky factor of the current configuration, by appending a row and column (rank-one, for all
+    added SNPs at once) or deleting one (with a rank-one update). The score of every configuration,
+    and the neighbourhood of every configuration visited, is cached, so revisits cost nothing, and
+    posterior probabilities are taken over all configurations scored.
+    """
+    def __init__(self, z, ld, n_samples, max_causal=5, prior_std=0.05):
+        self.z = np.asarray(z, dtype=float)
+        self.ld = np.asarray(ld, dtype=float)
+        self.m = len(self.z)
+        self.s2 = n_samples * prior_std**2
+        self.max_causal = max(1, min(max_causal, self.m))
+        self.log_p = math.log(1 / self.m) if self.m > 1 else 0.0
+        self.log_q = math.log1p(-1 / self.m) if self.m > 1 else 0.0
+        self.scores = {} # configuration (sorted tuple of SNPs) -> log prior + log BF
+        self.neighbourhoods = {} # configuration -> (neighbour configurations, their scores)
+        self.log_total = -np.inf # log of the sum of the scores of all configurations
+        self.iterations = 0
+
+    def log_prior(self, k):
+        return k * self.log_p + (self.m - k) * self.log_q
+
+    def _log_bf(self, quad, logdet):
+        return 0.5 * self.s2 * quad - 0.5 * logdet
+
+    def _factor(self, config):
+        """ Return the Cholesky factor L of I + s2 R of a configuration, and w = L^-1 z. """
+        config = list(config)
+        A = np.eye(len(config)) + self.s2 * self.ld[np.ix_(config, config)]
+        L = np.linalg.cholesky(A)
+        return L, solve_triangular(L, self.z[config], lower=True)
+
+    def _append(self, L, w, config, snps):
+        """ Return the (quad, logdet) of a configuration with each of snps appended (a rank-one extension of L). """
+        quad = w @ w
+        logdet = 2 * np.log(np.diag(L)).sum()
+        if len(config):
+            a = self.s2 * self.ld[np.ix_(list(config), snps)]
+            l = solve_triangular(L, a, lower=True)
+            d = 1 + self.s2 - (l * l).sum(axis=0)
+            r = self.z[snps] - l.T @ w
+        else:
+            d = np.full(len(snps), 1 + self.s2)
+            r = self.z[snps]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new_quad = np.where(d > 0, quad + r * r / d, np.nan)
+            new_logdet = np.where(d > 0, logdet + np.log(d), np.nan)
+        return new_quad, new_logdet
+
+    def _delete(self, L, config, i):
+        """ Return the Cholesky factor and w of a configuration without its i-th SNP (a rank-one update of L). """
+        keep = [j for j in range(len(config)) if j != i]
+        L_new = L[np.ix_(keep, keep)].copy()
+        cholesky_update(L_new[i:, i:], L[i + 1:, i].copy())
+        config = [config[j] for j in keep]
+        return L_new, solve_triangular(L_new, self.z[config], lower=True)
+
+    def neighbourhood(self, config):
+        """ Return the neighbour configurations of a configuration and their scores, scoring (and caching) them if new. """
+        if config in self.neighbourhoods:
+            return self.neighbourhoods[config]
+        k = len(config)
+        L, w = self._factor(config)
+        others = np.setdiff1d(np.arange(self.m), config)
+        configs = []
+        quads = []
+        logdets = []
+        sizes = []
+        for i in range(k if k > 1 else 0):
+            # deletion of SNP i, then swaps of SNP i for each other SNP
+            L_i, w_i = self._delete(L, config, i)
+            rest = config[:i] + config[i + 1:]
+            configs.append(rest)
+            quads.append([w_i @ w_i])
+            logdets.append([2 * np.log(np.diag(L_i)).sum()])
+            sizes.append([k - 1])
+            quad, logdet = self._append(L_i, w_i, rest, others)
+            configs.extend(tuple(sorted(rest + (j,))) for j in others.tolist())
+            quads.append(quad)
+            logdets.append(logdet)
+            sizes.append(np.full(len(others), k))
+        if k == 1:
+            # swaps of a single SNP are additions to the empty configuration
+            quad, logdet = self._append(np.zeros((0, 0)), np.zeros(0), (), others)
+            configs.extend((j,) for j in others.tolist())
+            quads.append(quad)
+            logdets.append(logdet)
+            sizes.append(np.full(len(others), 1))
+        if k < self.max_causal:
+            quad, logdet = self._append(L, w, config, others)
+            configs.extend(tuple(sorted(config + (j,))) for j in others.tolist())
+            quads.append(quad)
+            logdets.append(logdet)
+            sizes.append(np.full(len(others), k + 1))
+        if configs:
+            sizes = np.concatenate(sizes)
+            scores = self._log_bf(np.concatenate(quads), np.concatenate(logdets)) + self.log_prior(sizes)
+            scores = np.where(np.isnan(scores), -np.inf, scores)
+        else:
+            scores = np.zeros(0)
+        new = [j for j, neighbour in enumerate(configs) if neighbour not in self.scores]
+        self.scores.update((configs[j], scores[j]) for j in new)
+        if new:
+            self.log_total = np.logaddexp(self.log_total, logsumexp(scores[new]))
+        self.neighbourhoods[config] = (configs, scores)
+        return configs, scores
+
+    def score(self, config):
+        """ Return the score of a configuration, caching it. """
+        if config not in self.scores:
+            L, w = self._factor(config)
+            self.scores[config] = self._log_bf(w @ w, 2 * np.log(np.diag(L)).sum()) + self.log_prior(len(config))
+            self.log_total = np.logaddexp(self.log_total, self.scores[config])
+        return self.scores[config]
+
+    def search(self, n_iterations=100000, n_conv=100, prob_tol=0.001, seed=1):
+        """ Run the search from the SNP with the largest |z|, until the posterior mass of the configurations
+        found grows by less than prob_tol over n_conv iterations, or for n_iterations. """
+        rng = np.random.default_rng(seed)
+        config = (int(np.argmax(np.abs(self.z))),)
+        self.score(config)
+        history = [self.log_total]
+        for self.iterations in range(1, n_iterations + 1):
+            configs, scores = self.neighbourhood(config)
+            if not configs:
+                break
+            p = np.exp(scores - scores.max())
+            config = configs[rng.choice(len(configs), p=p / p.sum())]
+            history.append(self.log_total)
+            if self.iterations >= n_conv and history[-1] - history[-1 - n_conv] < math.log1p(prob_tol):
+                break
+        return self
+
+    def posteriors(self):
+        """ Return the configurations found, their posterior probabilities and log10 Bayes factors, most probable first. """
+        configs = list(self.scores)
+        scores = np.array([self.scores[config] for config in configs])
+        sizes = np.array([len(config) for config in configs])
+        prob = np.exp(scores - self.log_total)
+        log10bf = (scores - self.log_prior(sizes)) / math.log(10)
+        order = np.argsort(-prob, kind='stable')
+        return [configs[i] for i in order], prob[order], log10bf[order]
+
+    def snp_posteriors(self, configs, prob):
+        """ Return the posterior inclusion probability of each SNP, and its log10 Bayes factor (posterior odds / prior odds). """
+        pip = np.zeros(self.m)
+        for config, p in zip(configs, prob):
+            pip[list(config)] += p
+        pip = np.minimum(pip, 1)
+        k = np.arange(1, self.max_causal + 1)
+        prior_k = np.exp(self.log_prior(k) + log_binomial(self.m, k))
+        prior = (prior_k * k).sum() / prior_k.sum() / self.m
+        with np.errstate(divide='ignore'):
+            log10bf = np.log10(pip) - np.log10(1 - pip) - math.log10(prior / (1 - prior)) if prior < 1 else np.full(self.m, np.inf)
+        return pip, log10bf
+
+    def k_posteriors(self, configs, prob):
+        """ Return the posterior probability of each number of causal SNPs, 1..max_causal. """
+        sizes = np.array([len(config) for config in configs])
+        return np.bincount(sizes, prob, minlength=self.max_causal + 1)[1:]
+
+    def credible_sets(self, configs, prob, level=0.95):
+        """ Return a credible set (SNPs and probabilities, most probable first) for each causal signal.
+
+        The number of signals is the most probable number of causal SNPs, k. The SNPs of every configuration
+        of k SNPs are matched to the signals of the most probable one (greedily, by |r| with its SNPs),
+        giving each SNP a probability of being each signal; a signal's credible set is its most probable SNPs
+        up to a cumulative probability of level.
+        """
+        k = int(np.argmax(self.k_posteriors(configs, prob))) + 1
+        rows = [j for j, config in enumerate(configs) if len(config) == k]
+        members = np.array([configs[j] for j in rows]) # most probable first
+        weights = prob[rows]
+        top = members[0]
+        assigned = np.empty_like(members)
+        free = np.ones(members.shape, dtype=bool)
+        for signal in range(k):
+            r = np.where(free, np.abs(self.ld[top[signal]][members]), -1)
+            choice = np.argmax(r, axis=1)
+            assigned[:, signal] = members[np.arange(len(members)), choice]
+            free[np.arange(len(members)), choice] = False
+        sets = []
+        for signal in range(k):
+            snp_prob = np.bincount(assigned[:, signal], weights, minlength=self.m) / weights.sum()
+            order = np.argsort(-snp_prob, kind='stable')
+            count = int(np.searchsorted(np.cumsum(snp_prob[order]), level)) + 1
+            order = order[:count]
+            sets.append((order[snp_prob[order] > 0], snp_prob[order][snp_prob[order] > 0]))
+        return sets
+
+def cholesky_update(L, x):
+    """ Update a lower-triangular Cholesky factor in place to that of L L' + x x'. """
+    for k in range(len(x)):
+        r = math.hypot(L[k, k], x[k])
+        c = r / L[k, k]
+        s = x[k] / L[k, k]
+        L[k, k] = r
+        L[k + 1:, k] = (L[k + 1:, k] + s * x[k + 1:]) / c
+        x[k + 1:] = c * x[k + 1:] - s * L[k + 1:, k]
+
+def log_binomial(n, k):
+    return np.array([math.lgamma(n + 1) - math.lgamma(i + 1) - math.lgamma(n - i + 1) for i in np.atleast_1d(k)])
+
+def finemap(z_file, ld_file, snp_file, config_file, cred_file, log_file, n_samples, n_causal_snps=None):
+    """ Fine-map one locus from FINEMAP input files, writing FINEMAP's output files (see SSS).
+
+    Takes the files of a FINEMAP master file row (see craft.finemap.finemap): the z file, the LD
+    file and the sample size, and writes the .snp, .config and .cred files in the layout of FINEMAP
+    v1.3.1, and a log to log_file + '_sss' (as FINEMAP --log does). n_causal_snps is the
+    maximum number of causal SNPs (default 5, as FINEMAP).
+    """
+    start = time.perf_counter()
+    data = pd.read_csv(z_file, sep=' ')
+    data['z'] = data.beta / data.se
+    search = SSS(data.z.values, read.ld(ld_file).reshape(len(data), len(data)), float(n_samples), n_causal_snps or 5).search()
+    configs, prob, log10bf = search.posteriors()
+    pip, snp_log10bf = search.snp_posteriors(configs, prob)
+
+    # SNP file: SNPs by posterior inclusion probability
+    snps = data.assign(prob=pip, log10bf=snp_log10bf)
+    snps.insert(0, 'index', np.arange(1, len(data) + 1))
+    snps = snps.sort_values('prob', ascending=False, kind='stable')
+    snps.to_csv(snp_file, sep=' ', index=False, float_format='%g')
+
+    # config file: configurations found, most probable first
+    rsids = np.array(data.rsid.astype(str).tolist(), dtype=object)
+    configs_df = pd.DataFrame({
+        'rank': np.arange(1, len(configs) + 1),
+        'config': [','.join(rsids[list(config)]) for config in configs],
+        'prob': prob,
+        'log10bf': log10bf,
+        'odds': prob[0] / prob,
+        'k': [len(config) for config in configs],
+    })
+    configs_df.to_csv(config_file, sep=' ', index=False, float_format='%g')
+
+    # cred file: a credible set per signal, side by side
+    read.write_cred(cred_file, rsids, search.credible_sets(configs, prob))
+
+    with open(log_file + '_sss', 'w') as f:
+        f.write(f"SNPs: {search.m}\nSamples: {n_samples}\nMaximum causal SNPs: {search.max_causal}\n")
+        f.write(f"Iterations: {search.iterations}\nConfigurations evaluated: {len(search.scores)}\n")
+        f.write(f"Neighbourhoods evaluated: {len(search.neighbourhoods)}\n")
+        for k, p in enumerate(search.k_posteriors(configs, prob), 1):
+            f.write(f"Post-Pr(# of causal SNPs is {k}) = {p:g}\n")
+        f.write(f"Run time: {time.perf_counter() - start:.2f} s\n")
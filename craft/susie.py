@@ -0,0 +1,171 @@
+import math
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.optimize
+from scipy.special import logsumexp
+
+import craft.log as log
+import craft.read as read
+
+def susie_rss(z, ld, n_samples, L=10, prior_variance=0.2, max_iter=100, tol=1e-3, estimate_prior_variance=True):
+    """ Fit the sum of single effects model (SuSiE) to the z-scores and LD matrix of one locus.
+
+    This is SuSiE-RSS (as susieR's susie_rss with z and n): iterative Bayesian stepwise selection
+    on the sufficient statistics X'X = (n - 1) R, X'y = sqrt(n - 1) z and y'y = n - 1, with z adjusted
+    for the variance each SNP explains and the residual variance fixed at 1. Each of the L single effects
+    is refitted in turn against the residual of the others; the fitted effects are kept as X'X b (one
+    matrix-vector product per effect per iteration, the only O(SNPs^2) step), and the prior variance
+    of each effect is estimated by maximum likelihood (0, dropping the effect, if no effect fits as well).
+    Iteration stops once the evidence lower bound (ELBO) increases by less than tol, or after max_iter.
+
+    The cost is linear in L, rather than combinatorial in the number of causal SNPs as for
+    FINEMAP or PAINTOR. Returns a dictionary of the fit: alpha (L x SNPs, the probability that
+    each SNP is each effect), mu and mu2 (posterior means and second moments of effect sizes),
+    V (prior variances), lbf (the log Bayes factor of each effect), elbo (by iteration), converged,
+    and iterations.
+    """
+    z = np.asarray(z, dtype=float)
+    ld = np.asarray(ld, dtype=float)
+    p = len(z)
+    n = float(n_samples)
+    L = max(1, min(L, p))
+    z = z * np.sqrt((n - 1) / (z ** 2 + n - 2))
+    XtX = (n - 1) * ld
+    Xty = np.sqrt(n - 1) * z
+    yty = n - 1
+    d = np.diag(XtX).copy()
+    log_prior = np.full(p, -math.log(p))
+
+    alpha = np.full((L, p), 1 / p)
+    mu = np.zeros((L, p))
+    mu2 = np.zeros((L, p))
+    V = np.full(L, prior_variance)
+    lbf = np.zeros(L)
+    KL = np.zeros(L)
+    XtXB = np.zeros((L, p)) # X'X times each fitted effect
+    XtXr = np.zeros(p) # X'X times the sum of all fitted effects
+    elbo = [-np.inf]
+    converged = False
+    for iteration in range(1, max_iter + 1):
+        for l in range(L):
+            # residual of the other effects
+            XtR = Xty - XtXr + XtXB[l]
+            # single effect regression of the residual
+            betahat = XtR / d
+            shat2 = 1 / d
+            if estimate_prior_variance:
+                V[l] = optimize_prior_variance(betahat, shat2, log_prior)
+            lbf_snps = single_effect_lbf(V[l], betahat, shat2)
+            post_var = 1 / (1 / V[l] + d) if V[l] > 0 else np.zeros(p)
+            weighted = lbf_snps + log_prior
+            lbf[l] = logsumexp(weighted)
+            alpha[l] = np.exp(weighted - lbf[l])
+            mu[l] = post_var * XtR
+            mu2[l] = post_var + mu[l] ** 2
+            # the SER's contribution to the ELBO
+            KL[l] = -lbf[l] - 0.5 * (-2 * (XtR * alpha[l] * mu[l]).sum() + (d * alpha[l] * mu2[l]).sum())
+            XtXb_l = XtX @ (alpha[l] * mu[l])
+            XtXr += XtXb_l - XtXB[l]
+            XtXB[l] = XtXb_l
+        elbo.append(expected_loglik(Xty, yty, n, d, alpha, mu, mu2, XtXB, XtXr) - KL.sum())
+        if elbo[-1] - elbo[-2] < tol:
+            converged = True
+            break
+    return dict(alpha=alpha, mu=mu, mu2=mu2, V=V, lbf=lbf, elbo=elbo[1:], converged=converged, iterations=iteration)
+
+def single_effect_lbf(V, betahat, shat2):
+    """ Return the log Bayes factor of each SNP being the single effect, with prior variance V (0 for no effect). """
+    if V <= 0:
+        return np.zeros(len(betahat))
+    return 0.5 * np.log(shat2 / (V + shat2)) + 0.5 * betahat ** 2 / shat2 * V / (V + shat2)
+
+def optimize_prior_variance(betahat, shat2, log_prior):
+    """ Return the prior variance of a single effect that maximises its likelihood, as susieR's default
+    (estimate_prior_method 'optim', over log V in [-30, 15]).
+
+    As susieR's check_null_threshold, the prior variance is 0 (dropping the effect) if no effect fits as well.
+    """
+    def neg_loglik(log_V):
+        return -logsumexp(single_effect_lbf(math.exp(log_V), betahat, shat2) + log_prior)
+    result = scipy.optimize.minimize_scalar(neg_loglik, bounds=(-30, 15), method='bounded')
+    return math.exp(result.x) if -result.fun > 0 else 0.0
+
+def expected_loglik(Xty, yty, n, d, alpha, mu, mu2, XtXB, XtXr):
+    """ Return the expected log-likelihood of the SuSiE model, with residual variance 1.
+
+    XtXB holds X'X times each effect (alpha * mu), and XtXr X'X times their sum.
+    """
+    B = alpha * mu # L x SNPs
+    b = B.sum(axis=0)
+    erss = yty - 2 * b @ Xty + b @ XtXr - (B * XtXB).sum() + (d * alpha * mu2).sum()
+    return -0.5 * n * math.log(2 * math.pi) - 0.5 * erss
+
+def pips(fit, prior_tol=1e-9, effects=None):
+    """ Return the posterior inclusion probability of each SNP, from the effects with a prior variance above prior_tol.
+
+    If effects is given, only those effects are used: as susieR's prune_by_cs, the effects of the credible sets
+    (see credible_sets), leaving out effects that fit noise about as well as no effect.
+    """
+    keep = fit['V'] > prior_tol
+    if effects is not None:
+        keep &= np.isin(np.arange(len(keep)), list(effects))
+    alpha = fit['alpha'][keep]
+    return 1 - np.prod(1 - alpha, axis=0)
+
+def credible_sets(fit, ld, coverage=0.95, min_abs_corr=0.5, prior_tol=1e-9):
+    """ Return the credible sets of a fit, each an (effect, SNPs, probabilities) tuple, most probable SNP first.
+
+    Each effect with a prior variance above prior_tol gives a set of its most probable SNPs up to
+    a cumulative probability of coverage. As in susieR, a set is kept only if it is pure (the smallest
+    |r| between its SNPs is at least min_abs_corr), and only once if several effects give the same set.
+    """
+    sets = []
+    seen = set()
+    for l in np.flatnonzero(fit['V'] > prior_tol):
+        alpha = fit['alpha'][l]
+        order = np.argsort(-alpha, kind='stable')
+        count = int(np.searchsorted(np.cumsum(alpha[order]), coverage)) + 1
+        snps = order[:count]
+        if np.abs(ld[np.ix_(snps, snps)]).min() < min_abs_corr or frozenset(snps.tolist()) in seen:
+            continue
+        seen.add(frozenset(snps.tolist()))
+        sets.append((l, snps, alpha[snps]))
+    return sets
+
+def finemap(z_file, ld_file, snp_file, config_file, cred_file, log_file, n_samples, n_causal_snps=None):
+    """ Fine-map one locus with SuSiE-RSS from FINEMAP input files (see susie_rss).
+
+    Takes the files of a FINEMAP master file row (see craft.finemap.finemap), and writes a .snp file
+    of posterior inclusion probabilities (from the effects of the credible sets) and a .cred file of
+    credible sets, in the layouts of FINEMAP v1.3.1 (SuSiE has no configurations, so there is no
+    .config file), and a log of the fit, with its convergence and run time, to log_file + '_susie'.
+    n_causal_snps is the number of single effects (default 10, as susieR).
+    """
+    start = time.perf_counter()
+    data = pd.read_csv(z_file, sep=' ')
+    data['z'] = data.beta / data.se
+    ld = read.ld(ld_file).reshape(len(data), len(data))
+    fit = susie_rss(data.z.values, ld, float(n_samples), n_causal_snps or 10)
+    if not fit['converged']:
+        log.log(f"SuSiE did not converge for {z_file} after {fit['iterations']} iterations")
+    sets = credible_sets(fit, ld)
+    pip = pips(fit, effects=[l for l, snps_set, probs in sets])
+
+    # SNP file: SNPs by posterior inclusion probability
+    snps = data.assign(prob=pip)
+    snps.insert(0, 'index', np.arange(1, len(data) + 1))
+    snps = snps.sort_values('prob', ascending=False, kind='stable')
+    snps.to_csv(snp_file, sep=' ', index=False, float_format='%g')
+
+    # cred file: a credible set per effect, side by side
+    rsids = np.array(data.rsid.astype(str).tolist(), dtype=object)
+    read.write_cred(cred_file, rsids, [(snps_set, probs) for l, snps_set, probs in sets])
+
+    with open(log_file + '_susie', 'w') as f:
+        f.write(f"SNPs: {len(data)}\nSamples: {n_samples}\nSingle effects: {len(fit['V'])}\n")
+        f.write(f"Iterations: {fit['iterations']}\nConverged: {fit['converged']}\nELBO: {fit['elbo'][-1]:.6g}\n")
+        f.write(f"Prior variances: {' '.join(f'{v:.4g}' for v in fit['V'])}\n")
+        f.write(f"Credible sets: {len(sets)}\n")
+        f.write(f"Run time: {time.perf_counter() - start:.2f} s\n")
@@ -0,0 +1,188 @@
+import asyncio
+import os
+import subprocess
+import threading
+import time
+
+import craft.log as log
+
+class ToolRun:
+    """ The result of running an external tool: exit code and resource use of its last attempt. """
+    def __init__(self, name, args, returncode, wall, user, system, max_rss, attempts, timed_out=False):
+        self.name = name
+        self.args = args
+        self.returncode = returncode
+        self.wall = wall
+        self.user = user
+        self.system = system
+        self.max_rss = max_rss
+        self.attempts = attempts
+        self.timed_out = timed_out
+
+    def __repr__(self):
+        return (f"ToolRun({self.name!r}, returncode={self.returncode}, wall={self.wall:.2f}, "
+                f"cpu={self.user + self.system:.2f}, max_rss={self.max_rss}, attempts={self.attempts})")
+
+class ToolRunner:
+    """ Run external tools (LDstore, FINEMAP, PAINTOR, ANNOVAR) as subprocesses from an asyncio event loop.
+
+    Tools are run from argument lists (no shell), at most max_procs at once (and at most limits[name]
+    of a named tool), with an optional timeout in seconds, and retried up to retries times if they fail
+    or time out. Each process is reaped with os.wait4, giving its wall time, user and system CPU time
+    and peak resident set size, which are kept in records. (On Linux, the peak resident set size of a
+    child process includes the memory it shared with CRAFT before exec, so it is never below CRAFT's own.)
+
+    The event loop runs in a background thread, so run can be called from any thread and
+    concurrent calls run concurrently; cancel kills every running tool.
+    """
+    def __init__(self, max_procs=None, limits=None, timeout=None, retries=0):
+        self.max_procs = max_procs or os.cpu_count() or 1
+        self.limits = dict(limits or {})
+        self.timeout = timeout
+        self.retries = retries
+        self.records = []
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._tasks = set()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._semaphores = {}
+
+    def _semaphore(self, name):
+        """ Return the semaphore limiting all tools (name None) or one named tool; only called in the loop. """
+        if name not in self._semaphores:
+            self._semaphores[name] = asyncio.Semaphore(self.max_procs if name is None else self.limits[name])
+        return self._semaphores[name]
+
+    async def _wait(self, proc):
+        """ Wait for a process with os.wait4 (in a thread, so the loop is not blocked); returns (status, rusage). """
+        future = self._loop.create_future()
+        def wait():
+            pid, status, rusage = os.wait4(proc.pid, 0)
+            self._loop.call_soon_threadsafe(future.set_result, (status, rusage))
+        threading.Thread(target=wait, daemon=True).start()
+        return await future
+
+    async def _run_once(self, name, args, timeout, stdout, stderr):
+        start = time.monotonic()
+        try:
+            proc = subprocess.Popen(args, stdout=stdout, stderr=stderr)
+        except OSError as e: # e.g. the executable is missing; reported as the shell would
+            log.log(f"{name}: {e}")
+            return ToolRun(name, args, 127, time.monotonic() - start, 0.0, 0.0, 0, 1)
+        waiting = asyncio.ensure_future(self._wait(proc))
+        timed_out = False
+        try:
+            status, rusage = await asyncio.wait_for(asyncio.shield(waiting), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            status, rusage = await waiting
+            timed_out = True
+        except asyncio.CancelledError:
+            proc.kill()
+            await waiting
+            raise
+        proc.returncode = os.waitstatus_to_exitcode(status) # already reaped, so Popen must not wait for it
+        return ToolRun(name, args, proc.returncode, time.monotonic() - start, rusage.ru_utime, rusage.ru_stime,
+                       rusage.ru_maxrss * 1024, 1, timed_out)
+
+    async def run_async(self, args, name=None, timeout=None, retries=None, stdout=None, stderr=None):
+        """ Run a tool (coroutine); see run. """
+        args = [str(arg) for arg in args]
+        name = name or os.path.basename(args[0])
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        semaphores = [self._semaphore(None)] + ([self._semaphore(name)] if name in self.limits else [])
+        for attempt in range(1, retries + 2):
+            for semaphore in semaphores:
+                await semaphore.acquire()
+            try:
+                result = await self._run_once(name, args, timeout, stdout, stderr)
+            finally:
+                for semaphore in semaphores:
+                    semaphore.release()
+            result.attempts = attempt
+            with self._lock:
+                self.records.append(result)
+            if result.returncode == 0:
+                break
+            log.log(f"{name} failed (exit code {result.returncode}{', timed out' if result.timed_out else ''}), "
+                    f"attempt {attempt} of {retries + 1}: {' '.join(args)}")
+        return result
+
+    def run(self, args, name=None, timeout=None, retries=None, stdout=None, stderr=None):
+        """ Run a tool and wait for it, returning a ToolRun.
+
+        args is the argument list (the first is the executable); name (by default the executable's
+        file name) is used for limits and in records. timeout and retries default to the runner's.
+        stdout and stderr are passed to subprocess.Popen.
+        """
+        return self.run_all([dict(args=args, name=name, timeout=timeout, retries=retries, stdout=stdout, stderr=stderr)])[0]
+
+    def run_all(self, calls):
+        """ Run several tools concurrently (within the limits), each call a dict of run arguments; returns a list of ToolRuns. """
+        async def gather():
+            tasks = [asyncio.ensure_future(self.run_async(**call)) for call in calls]
+            self._tasks.update(tasks)
+            try:
+                return await asyncio.gather(*tasks)
+            finally:
+                self._tasks.difference_update(tasks)
+        return asyncio.run_coroutine_threadsafe(gather(), self._loop).result()
+
+    def cancel(self):
+        """ Cancel every running tool, killing its process. """
+        def cancel_all():
+            for task in list(self._tasks):
+                task.cancel()
+        self._loop.call_soon_threadsafe(cancel_all)
+
+    def take_records(self):
+        """ Return the records of tools run so far, and clear them. """
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+# The runner of this process, made by configure or on first use.
+_runner = None
+_settings = {}
+_runner_lock = threading.Lock()
+
+def configure(max_procs=None, limits=None, timeout=None, retries=0):
+    """ Set the options of the tool runner of this process (and of processes forked from it). """
+    global _runner
+    _settings.update(max_procs=max_procs, limits=limits, timeout=timeout, retries=retries)
+    _runner = None
+
+def runner():
+    """ Return the tool runner of this process; a forked process makes its own, as threads are not forked. """
+    global _runner
+    with _runner_lock:
+        if _runner is None or _runner.pid != os.getpid():
+            _runner = ToolRunner(**_settings)
+        return _runner
+
+def run(args, name=None, check=True, **kwargs):
+    """ Run a tool with this process's runner (see ToolRunner.run).
+
+    With check, a tool that still fails after its retries is an error (see log.error).
+    """
+    result = runner().run(args, name, **kwargs)
+    if check and result.returncode != 0:
+        log.error(f"Error: {result.name} failed with exit code {result.returncode}: {' '.join(result.args)}")
+    return result
+
+def summary(records):
+    """ Summarise ToolRuns by tool: calls, failed attempts, total wall and CPU time and largest peak RSS. """
+    tools = {}
+    for record in records:
+        tool = tools.setdefault(record.name, dict(calls=0, failed=0, wall=0.0, cpu=0.0, max_rss=0))
+        tool['calls'] += 1
+        tool['failed'] += record.returncode != 0
+        tool['wall'] += record.wall
+        tool['cpu'] += record.user + record.system
+        tool['max_rss'] = max(tool['max_rss'], record.max_rss)
+    return [f"{name}: {tool['calls']} runs ({tool['failed']} failed), wall {tool['wall']:.1f} s, "
+            f"CPU {tool['cpu']:.1f} s, peak RSS {tool['max_rss'] / 2**20:.1f} MB"
+            for name, tool in sorted(tools.items())]
@@ -17,14 +17,24 @@ import sys
 sys.path.insert(0, os.path.abspath('..'))
 autodoc_mock_imports = ['annotate']
 import craft.abf
+import craft.annocache
 import craft.annotate
 import craft.config
+import craft.enumeration
 import craft.getSNPs
 import craft.finemap
+import craft.ldcache
+import craft.ldstore
 import craft.log
 import craft.main
+import craft.manifest
 import craft.paintor
+import craft.pipeline
 import craft.read
+import craft.refgene
+import craft.sss
+import craft.susie
+import craft.tools
 import craft.visualise
 
 # -- Project information -----------------------------------------------------
@@ -10,6 +10,7 @@ requirements = [
     'pandas>=0.2',
     'numpy>=1.0',
     'scipy>=1.0',
+    'pyarrow>=10.0',
     'PyVcf>=0.1',
     'matplotlib>=3.0.3'
 ]
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+# Check the in-process refGene annotator (craft.refgene.RefGene) against ANNOVAR on a small
+# refGene fixture: its var_effect and genes must match the .variant_function output of
+# annotate_variation.pl on the same fixture. Splicing and intergenic distances are compared
+# too; exonic_variant_function is not (RefGene does not produce it).
+#
+# The reference is ANNOVAR's own output only: annotate_variation.pl is run if --annovar_dir
+# holds it, and otherwise expected.variant_function is used, which must be that output
+# (saved with --save_expected). Until it exists, --annotator native is not validated.
+#
+# Usage: python test/annotation/compare_annovar.py [--annovar_dir annovar] [--save_expected]
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import pandas as pd
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.abspath(os.path.join(here, '..', '..'))
+sys.path.insert(0, root)
+from craft import config
+from craft import refgene
+
+expected_file = os.path.join(here, 'expected.variant_function')
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--annovar_dir', default=os.path.join(root, config.annovar_dir),
+                        help='ANNOVAR directory; if annotate_variation.pl is not found, expected.variant_function is used. Default = %(default)s.')
+    parser.add_argument('--save_expected', action='store_true',
+                        help='Save the output of annotate_variation.pl as expected.variant_function. Default = %(default)s.')
+    return parser.parse_args()
+
+def read_variant_function(file):
+    cols = ['var_effect', 'genes', 'chromosome', 'start', 'end', 'ref', 'alt']
+    return pd.read_csv(file, sep='\t', names=cols, dtype=str)
+
+def run_annovar(script, save_expected):
+    """ Annotate the fixture with annotate_variation.pl -geneanno -buildver hg19, returning its .variant_function. """
+    with tempfile.TemporaryDirectory() as tempdir:
+        humandb = os.path.join(tempdir, 'humandb')
+        os.mkdir(humandb)
+        shutil.copy(os.path.join(here, 'hg19_refGene.txt'), humandb)
+        shutil.copy(os.path.join(here, 'variants.avinput'), tempdir)
+        avinput = os.path.join(tempdir, 'variants.avinput')
+        subprocess.run([script, '-geneanno', '-dbtype', 'refGene', '-buildver', 'hg19', avinput, humandb], check=True)
+        if save_expected:
+            shutil.copy(avinput + '.variant_function', expected_file)
+        return read_variant_function(avinput + '.variant_function')
+
+def compare(name, expected, found):
+    mismatches = (expected.var_effect != found.var_effect) | (expected.genes != found.genes)
+    for i in mismatches[mismatches].index:
+        print(f"{name}: {expected.chromosome[i]}:{expected.start[i]} expected {expected.var_effect[i]} {expected.genes[i]},"
+              f" found {found.var_effect[i]} {found.genes[i]}")
+    print(f"{name}: {len(expected) - mismatches.sum()} of {len(expected)} variants match")
+    return not mismatches.any()
+
+def main():
+    args = parse_args()
+    script = os.path.join(args.annovar_dir, 'annotate_variation.pl')
+    if os.path.exists(script):
+        name, annovar = 'native vs ANNOVAR', run_annovar(script, args.save_expected)
+    elif os.path.exists(expected_file):
+        name, annovar = 'native vs ANNOVAR (expected.variant_function)', read_variant_function(expected_file)
+    else:
+        print(f"{script} not found, and no expected.variant_function saved from it: --annotator native is not validated")
+        sys.exit(1)
+    variants = pd.read_csv(os.path.join(here, 'variants.avinput'), sep='\t', names=['chromosome', 'position', 'end', 'ref', 'alt'])
+    native = refgene.RefGene(os.path.join(here, 'hg19_refGene.txt')).annotate(variants)
+    native = native.astype(str).rename(columns={'position': 'start'})
+    # ANNOVAR gives splicing details in the gene column, e.g. GENEA(NM_000001:exon1:c.301+1A>G)
+    annovar['genes'] = annovar.genes.where(~annovar.var_effect.str.contains('splicing'),
+                                           annovar.genes.str.replace(r'\(NM_[^)]*\)|\(NR_[^)]*\)', '', regex=True))
+    sys.exit(0 if compare(name, annovar, native) else 1)
+
+if __name__ == '__main__':
+    main()
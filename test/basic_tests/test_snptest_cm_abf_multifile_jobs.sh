@@ -0,0 +1,3 @@
+#!/bin/bash
+
+python -m craft --file "test/snptest_data/chr*.snptest.maf0.01.out" --type snptest --alpha 5e-5 --distance_unit cm --distance 0.1 --outdir output --jobs 4
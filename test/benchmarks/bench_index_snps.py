@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+# Benchmark index SNP selection (craft.getSNPs.get_index_snps_cm and get_index_snps_bp)
+# against the original loop, which repeatedly took the SNP with the lowest p value and
+# dropped its region, on synthetic SNPs along a genetic map shipped with CRAFT, and check
+# that both give the same index table, for regions in cM and in bp.
+#
+# Usage: python test/benchmarks/bench_index_snps.py [--snps 20000] [--chromosome 14]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, root)
+from craft import config
+from craft import read
+import craft.getSNPs as gs
+from bench_interpolate import original_interpolate_cm, original_interpolate_bp
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--snps', type=int, default=20000, help='Number of SNPs. Default = %(default)s.')
+    parser.add_argument('--chromosome', default='14', help='Chromosome (of the genetic maps) the SNPs are on. Default = %(default)s.')
+    parser.add_argument('--alpha', type=float, default=5e-8, help='P-value threshold for index SNPs. Default = %(default)s.')
+    parser.add_argument('--distance_cm', type=float, default=0.1, help='Region distance in cM. Default = %(default)s.')
+    parser.add_argument('--distance_bp', type=int, default=50000, help='Region distance in bp. Default = %(default)s.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed. Default = %(default)s.')
+    return parser.parse_args()
+
+def original_index_snps_cm(df, alpha, distance, maps):
+    """ The original get_index_snps_cm (with .ix replaced by .loc, and rows collected rather than appended). """
+    col_names = list(df.columns.values) + ['region_start_cm','region_end_cm', 'region_size_kb']
+    rows = []
+    while df.pvalue.min() <= alpha:
+        index_snp = df.loc[df.pvalue.idxmin()]
+        index_snp_cm = original_interpolate_cm(index_snp.position, maps[str(int(index_snp.chromosome))])
+        region_start = original_interpolate_bp(index_snp_cm - distance, maps[str(int(index_snp.chromosome))])
+        region_end = original_interpolate_bp(index_snp_cm + distance, maps[str(int(index_snp.chromosome))])
+        region_size = round((region_end - region_start)/float(1000),1)
+        rows.append(list(index_snp.values) + [region_start, region_end, region_size])
+        df = df.loc[~df.position.between(region_start, region_end)]
+    index_df = pd.DataFrame(rows, columns=col_names)
+    index_df.region_start_cm = index_df.region_start_cm.astype(int)
+    index_df.region_end_cm = index_df.region_end_cm.astype(int)
+    return index_df
+
+def original_index_snps_bp(df, alpha, distance):
+    """ The original get_index_snps_bp (with .ix replaced by .loc, and rows collected rather than appended). """
+    col_names = list(df.columns.values) + ['region_start_bp','region_end_bp']
+    rows = []
+    while df.pvalue.min() <= alpha:
+        index_snp = df.loc[df.pvalue.idxmin()]
+        region_start = index_snp.position - distance
+        region_end = index_snp.position + distance
+        rows.append(list(index_snp.values) + [region_start, region_end])
+        df = df.loc[~df.position.between(region_start, region_end)]
+    index_df = pd.DataFrame(rows, columns=col_names)
+    index_df.region_start_bp = index_df.region_start_bp.astype(int)
+    index_df.region_end_bp = index_df.region_end_bp.astype(int)
+    return index_df
+
+def make_snps(rng, n_snps, chromosome, map_file, distance_cm):
+    """ Simulate SNPs within a genetic map, with p values down to 1e-12 (rounded, so some are tied). """
+    map_position, map_cm = gs.map_arrays(map_file)
+    inner = (map_cm > map_cm[0] + distance_cm) & (map_cm < map_cm[-1] - distance_cm)
+    positions = np.sort(rng.choice(np.arange(map_position[inner][0], map_position[inner][-1]), n_snps, replace=False))
+    pvalues = np.array([float(f"{p:.2g}") for p in 10 ** -rng.uniform(0, 12, n_snps)])
+    return pd.DataFrame({
+        'chromosome': int(chromosome),
+        'position': positions,
+        'rsid': [f"rs{i}" for i in range(n_snps)],
+        'pvalue': pvalues,
+    })
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    maps = read.maps(os.path.join(root, config.genetic_map_dir))
+    df = make_snps(rng, args.snps, args.chromosome, maps[args.chromosome], args.distance_cm)
+    runs = [
+        ('cM', lambda: original_index_snps_cm(df, args.alpha, args.distance_cm, maps),
+               lambda: gs.get_index_snps_cm(df, args.alpha, args.distance_cm, True, maps)),
+        ('bp', lambda: original_index_snps_bp(df, args.alpha, args.distance_bp),
+               lambda: gs.get_index_snps_bp(df, args.alpha, args.distance_bp, True)),
+    ]
+    for unit, original, selected in runs:
+        start = time.perf_counter()
+        old = original()
+        old_time = time.perf_counter() - start
+        start = time.perf_counter()
+        new = selected()
+        new_time = time.perf_counter() - start
+        pd.testing.assert_frame_equal(old.infer_objects(), new, check_dtype=False)
+        print(f"{unit}: {args.snps} SNPs, {len(new)} index SNPs, original {old_time:.3f}s, "
+              f"selected {new_time:.3f}s, speedup {old_time / new_time:.0f}x (index tables match)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
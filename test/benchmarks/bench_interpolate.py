@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+# Benchmark the vectorised bp <-> cM interpolation (craft.getSNPs.interpolate_cm_array
+# and interpolate_bp_array) against the original per-lookup interp1d implementation on
+# the genetic maps shipped with CRAFT, and check that both give the same region boundaries.
+#
+# Usage: python test/benchmarks/bench_interpolate.py [--lookups 50] [--distance 0.1]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import scipy.interpolate
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, root)
+from craft import config
+from craft import read
+import craft.getSNPs as gs
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lookups', type=int, default=50, help='Index SNP positions per chromosome. Default = %(default)s.')
+    parser.add_argument('--distance', type=float, default=0.1, help='Region distance in cM. Default = %(default)s.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed. Default = %(default)s.')
+    return parser.parse_args()
+
+def original_interpolate_cm(bp, map_file):
+    """ The original interpolate_cm (with .ix replaced by .iloc). """
+    if bp in map_file['Position(bp)'].values:
+        cm = map_file['Map(cM)'].loc[map_file['Position(bp)'] == bp].values.astype(float)[0]
+    else:
+        index_location = np.searchsorted(np.array(map_file['Position(bp)']), bp)
+        lower_bp = map_file['Position(bp)'].iloc[index_location -1]
+        upper_bp = map_file['Position(bp)'].iloc[index_location]
+        interpolation_range_bp = range(lower_bp,upper_bp,1)
+        cm_interpolator = scipy.interpolate.interp1d(map_file['Position(bp)'], map_file['Map(cM)'])
+        interpolation_range_cm = cm_interpolator(interpolation_range_bp)
+        cm = interpolation_range_cm[interpolation_range_bp.index(bp)]
+    return cm
+
+def original_interpolate_bp(cm, map_file):
+    """ The original interpolate_bp (with .ix replaced by .iloc). """
+    index_location = np.searchsorted(np.array(map_file['Map(cM)']), cm)
+    lower_bp = map_file['Position(bp)'].iloc[index_location -1]
+    upper_bp = map_file['Position(bp)'].iloc[index_location]
+    interpolation_range_bp = range(lower_bp,upper_bp,1)
+    cm_interpolator = scipy.interpolate.interp1d(map_file['Position(bp)'], map_file['Map(cM)'])
+    interpolation_range_cm = cm_interpolator(interpolation_range_bp)
+    return interpolation_range_bp[abs(interpolation_range_cm - cm).argmin()]
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    maps = read.maps(os.path.join(root, config.genetic_map_dir))
+    total_old = total_new = 0
+    for chromosome in sorted(maps, key=int):
+        map_file = maps[chromosome]
+        map_position, map_cm = gs.map_arrays(map_file)
+        # random positions well inside the map, plus some exact map positions
+        inner = (map_cm > map_cm[0] + args.distance) & (map_cm < map_cm[-1] - args.distance)
+        positions = rng.integers(map_position[inner][0], map_position[inner][-1], args.lookups)
+        positions[:10] = rng.choice(map_position[inner], 10)
+
+        start = time.perf_counter()
+        old = []
+        for bp in positions:
+            cm = original_interpolate_cm(bp, map_file)
+            old.append((cm, original_interpolate_bp(cm - args.distance, map_file),
+                        original_interpolate_bp(cm + args.distance, map_file)))
+        old_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cm = gs.interpolate_cm_array(positions, map_position, map_cm)
+        region_start = gs.interpolate_bp_array(cm - args.distance, map_position, map_cm)
+        region_end = gs.interpolate_bp_array(cm + args.distance, map_position, map_cm)
+        new_time = time.perf_counter() - start
+
+        old_cm, old_start, old_end = (np.array(col) for col in zip(*old))
+        assert np.array_equal(old_cm, cm)
+        assert np.array_equal(old_start, region_start)
+        assert np.array_equal(old_end, region_end)
+        total_old += old_time
+        total_new += new_time
+        print(f"chr{chromosome}: {args.lookups} regions, original {old_time:.3f}s, "
+              f"vectorised {new_time * 1000:.2f}ms (boundaries match)")
+    print(f"total: original {total_old:.3f}s, vectorised {total_new:.3f}s, speedup {total_old / total_new:.0f}x")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#
+# Benchmark the columnar .npz store of internal dataframes (craft.read.save_dfs and
+# load_dfs, as used for <file>.abf.npz) on a synthetic locus table, in the default and
+# the compact (craft.read.compact) schemas, and check that both round-trip exactly:
+# the same values and dtypes, including categorical chromosomes and alleles.
+#
+# Usage: python test/benchmarks/bench_npz.py [--snps 1000000]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from craft import read
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--snps', type=int, default=1000000, help='Number of SNPs. Default = %(default)s.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed. Default = %(default)s.')
+    return parser.parse_args()
+
+def make_loci(rng, n_snps):
+    """ Simulate an internal locus table (as read.snptest gives, with ABF columns) over a few chromosomes. """
+    alleles = np.array(['A', 'C', 'G', 'T'])
+    return pd.DataFrame({
+        'chromosome': rng.choice([1, 6, 22], n_snps),
+        'allele1': alleles[rng.integers(0, 4, n_snps)],
+        'allele2': alleles[rng.integers(0, 4, n_snps)],
+        'rsid': [f"rs{i}" for i in range(n_snps)],
+        'position': np.sort(rng.integers(1, 2**30, n_snps)),
+        'all_total': 5000, 'cases_total': 2000, 'controls_total': 3000,
+        'maf': rng.uniform(0.01, 0.5, n_snps),
+        'pvalue': 10 ** -rng.uniform(0, 12, n_snps),
+        'beta': rng.normal(0, 0.1, n_snps),
+        'se': rng.uniform(0.01, 0.1, n_snps),
+        'index_rsid': 'rs0',
+        'ABF': rng.uniform(0, 10, n_snps),
+    }).set_index('index_rsid', drop=False)
+
+def main():
+    args = parse_args()
+    loci = make_loci(np.random.default_rng(args.seed), args.snps)
+    with tempfile.TemporaryDirectory() as tempdir:
+        for schema, df in [('default', loci), ('compact', read.compact(loci))]:
+            file = os.path.join(tempdir, schema + '.npz')
+            start = time.perf_counter()
+            read.save_dfs(file, {'loci': df})
+            save_time = time.perf_counter() - start
+            start = time.perf_counter()
+            loaded = read.load_dfs(file)['loci']
+            load_time = time.perf_counter() - start
+            pd.testing.assert_frame_equal(loaded, df)
+            assert loaded.chromosome.iloc[0] == df.chromosome.iloc[0]
+            print(f"{schema}: {args.snps} SNPs, {df.memory_usage(deep=True).sum() / 2**20:.0f} MB in memory, "
+                  f"{os.path.getsize(file) / 2**20:.0f} MB on disk, save {save_time:.2f}s, load {load_time:.2f}s (round trip matches)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#
+# Benchmark the PLINK reader (craft.read.plink) against the original implementation, on
+# the test/psa_ichp_test .assoc.logistic files scaled up synthetically (each file repeated
+# --scale times with new rsids and positions) and a synthetic .frq.cc file covering all
+# chromosomes. Checks that both readers give the same internal dataframe.
+#
+# Usage: python test/benchmarks/bench_plink.py [--scale 2] [--skip-original]
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, root)
+from craft import read
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=int, default=2, help='Number of copies of each test file. Default = %(default)s.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed. Default = %(default)s.')
+    parser.add_argument('--skip-original', action='store_true', help='Only time the new reader (the original is quadratic).')
+    return parser.parse_args()
+
+def original_plink(file, frq_file):
+    """ The original read.plink, with its per-row loops. """
+    cols = ['CHR','A1','SNP','BP','P','SE','OR']
+    df = pd.read_csv(file, sep=r'\s+')[cols]
+    df.rename(columns={'CHR':'chromosome','SNP':'rsid','BP':'position','A1':'allele1','P':'pvalue','SE':'se'}, inplace=True)
+    for index, row in df.iterrows():
+        df['beta'] = np.log(df['OR'])
+    cols = ['CHR','SNP','A2','MAF_A','MAF_U','NCHROBS_A', 'NCHROBS_U']
+    frq_df = pd.read_csv(frq_file, sep=r'\s+')[cols]
+    frq_df.rename(columns={'CHR':'chromosome','SNP':'rsid','A2':'allele2','MAF_U':'maf','NCHROBS_A':'cases_total','NCHROBS_U':'controls_total'}, inplace=True)
+    frq_df.loc[frq_df['maf'] > 0.5, 'maf'] = 0.5
+    frq_df = frq_df[frq_df['chromosome'].isin(df.chromosome.unique())]
+    frq_df = frq_df.drop(columns=["chromosome", "MAF_A"])
+    for index, row in frq_df.iterrows():
+        frq_df['all_total'] = frq_df['cases_total'] + frq_df['controls_total']
+    df = pd.merge(df, frq_df, how='inner', on='rsid')
+    order = ['chromosome','allele1','allele2','rsid','position','all_total', 'cases_total','controls_total','maf','pvalue', 'beta', 'se']
+    return df[order]
+
+def make_files(tempdir, scale, rng):
+    """ Write scaled-up .assoc.logistic files and a matching .frq.cc file; return their names. """
+    assoc_files = []
+    frq_dfs = []
+    for file in sorted(glob.glob(os.path.join(root, 'test', 'psa_ichp_test', '*.assoc.logistic'))):
+        df = pd.read_csv(file, sep=r'\s+')
+        copies = []
+        for k in range(scale):
+            copy = df.copy()
+            copy['SNP'] = copy['SNP'] + f"_{k}"
+            copy['BP'] = copy['BP'] + k * 300000000
+            copies.append(copy)
+        df = pd.concat(copies, ignore_index=True)
+        assoc_file = os.path.join(tempdir, os.path.basename(file))
+        df.to_string(open(assoc_file, 'w'), index=False)
+        assoc_files.append(assoc_file)
+        n = len(df)
+        frq_dfs.append(pd.DataFrame({
+            'CHR': df['CHR'], 'SNP': df['SNP'], 'A1': df['A1'],
+            'A2': rng.choice(list('ACGT'), n),
+            'MAF_A': rng.uniform(0.01, 0.6, n), 'MAF_U': rng.uniform(0.01, 0.6, n),
+            'NCHROBS_A': rng.integers(3000, 4000, n), 'NCHROBS_U': rng.integers(7000, 8000, n)}))
+    frq_file = os.path.join(tempdir, 'test.frq.cc')
+    pd.concat(frq_dfs).sample(frac=1, random_state=1).to_string(open(frq_file, 'w'), index=False)
+    return assoc_files, frq_file
+
+def same(old, new):
+    """ Check two internal dataframes hold the same values (alleles may be categorical). """
+    if list(old.columns) != list(new.columns) or len(old) != len(new):
+        return False
+    for col in old.columns:
+        if pd.api.types.is_float_dtype(old[col]):
+            if not np.allclose(old[col].values, new[col].values, equal_nan=True):
+                return False
+        elif list(old[col].astype(str)) != list(new[col].astype(str)):
+            return False
+    return True
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as tempdir:
+        assoc_files, frq_file = make_files(tempdir, args.scale, rng)
+        for file in assoc_files:
+            start = time.perf_counter()
+            new = read.plink(file, frq_file)
+            new_time = time.perf_counter() - start
+            message = f"{os.path.basename(file)} x {args.scale} ({len(new)} SNPs): new {new_time:.3f}s"
+            if not args.skip_original:
+                start = time.perf_counter()
+                old = original_plink(file, frq_file)
+                old_time = time.perf_counter() - start
+                assert same(old, new)
+                message += f", original {old_time:.3f}s, speedup {old_time / new_time:.0f}x (outputs match)"
+            print(message)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
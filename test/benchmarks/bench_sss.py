@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+#
+# Benchmark the native shotgun stochastic search (craft.sss.SSS) on simulated
+# loci, and check it against exhaustive enumeration of all configurations of up
+# to --max_causal SNPs: the search must find nearly all of the posterior mass,
+# and give nearly the same posterior inclusion probabilities.
+#
+# Usage: python test/benchmarks/bench_sss.py [--loci 5] [--snps 60] [--max_causal 3]
+
+import argparse
+import itertools
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from craft import sss
+from simulate import make_locus
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--loci', type=int, default=5, help='Number of loci. Default = %(default)s.')
+    parser.add_argument('--snps', type=int, default=60, help='SNPs per locus. Default = %(default)s.')
+    parser.add_argument('--max_causal', type=int, default=3, help='Maximum number of causal SNPs. Default = %(default)s.')
+    parser.add_argument('--n_samples', type=int, default=5000, help='GWAS sample size. Default = %(default)s.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed. Default = %(default)s.')
+    return parser.parse_args()
+
+def exhaustive(z, ld, n_samples, max_causal):
+    """ Posterior inclusion probabilities over every configuration, scored with the same model. """
+    model = sss.SSS(z, ld, n_samples, max_causal)
+    configs = [config for k in range(1, max_causal + 1) for config in itertools.combinations(range(len(z)), k)]
+    scores = np.array([model.score(config) for config in configs])
+    prob = np.exp(scores - model.log_total)
+    pip, _ = model.snp_posteriors(configs, prob)
+    return pip, model.log_total
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    for locus in range(args.loci):
+        z, ld, causal = make_locus(rng, args.snps, 2, args.n_samples)
+        start = time.perf_counter()
+        search = sss.SSS(z, ld, args.n_samples, args.max_causal).search()
+        configs, prob, log10bf = search.posteriors()
+        pip, _ = search.snp_posteriors(configs, prob)
+        search_time = time.perf_counter() - start
+        start = time.perf_counter()
+        exact_pip, exact_log_total = exhaustive(z, ld, args.n_samples, args.max_causal)
+        exact_time = time.perf_counter() - start
+        mass = math.exp(search.log_total - exact_log_total)
+        assert mass > 0.99 and np.abs(pip - exact_pip).max() < 0.01
+        print(f"locus {locus}: {args.snps} SNPs, search {search_time:.3f}s ({search.iterations} iterations, "
+              f"{len(search.scores)} configurations), exhaustive {exact_time:.3f}s; "
+              f"posterior mass found {mass:.4f}, largest PIP difference {np.abs(pip - exact_pip).max():.2g}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
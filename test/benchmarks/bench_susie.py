@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+#
+# Benchmark the SuSiE-RSS engine (craft.susie.susie_rss) against the native
+# shotgun stochastic search (craft.sss.SSS) on simulated loci of increasing
+# size, and check that SuSiE converges with a non-decreasing ELBO, that its
+# posterior inclusion probabilities sum to the number of causal SNPs and that
+# its credible sets cover them.
+#
+# Usage: python test/benchmarks/bench_susie.py [--snps 200 1000 3000] [--sss_max 500]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from craft import sss
+from craft import susie
+from simulate import make_locus
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--snps', type=int, nargs='+', default=[200, 1000, 3000], help='SNPs per locus. Default = %(default)s.')
+    parser.add_argument('--causal', type=int, default=3, help='Causal SNPs per locus. Default = %(default)s.')
+    parser.add_argument('--sss_max', type=int, default=500, help='Largest locus also run with SSS. Default = %(default)s.')
+    parser.add_argument('--n_samples', type=int, default=5000, help='GWAS sample size. Default = %(default)s.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed. Default = %(default)s.')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    for n_snps in args.snps:
+        z, ld, causal = make_locus(rng, n_snps, args.causal, args.n_samples)
+        start = time.perf_counter()
+        fit = susie.susie_rss(z, ld, args.n_samples)
+        susie_time = time.perf_counter() - start
+        sets = susie.credible_sets(fit, ld)
+        pip = susie.pips(fit, effects=[l for l, snps, probs in sets])
+        covered = sum(any(snp in snps for l, snps, probs in sets) for snp in causal)
+        assert fit['converged'] and np.all(np.diff(fit['elbo']) > -1e-6)
+        assert abs(pip.sum() - len(causal)) < 0.1 and covered == len(causal)
+        line = (f"{n_snps} SNPs: susie {susie_time:.3f}s ({fit['iterations']} iterations), "
+                f"{len(sets)} credible sets covering {covered} of {len(causal)} causal SNPs, PIPs summing to {pip.sum():.3f}")
+        if n_snps <= args.sss_max:
+            start = time.perf_counter()
+            search = sss.SSS(z, ld, args.n_samples).search()
+            configs, prob, log10bf = search.posteriors()
+            sss_pip, _ = search.snp_posteriors(configs, prob)
+            sss_time = time.perf_counter() - start
+            line += (f"; sss {sss_time:.3f}s ({len(search.scores)} configurations), "
+                     f"largest PIP difference {np.abs(sss_pip - pip).max():.2g}")
+        print(line)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,24 @@
+# Simulated fine-mapping loci shared by the benchmarks of the in-process
+# fine-mapping engines (bench_sss.py, bench_susie.py, bench_enumeration.py).
+
+import math
+
+import numpy as np
+
+def make_locus(rng, n_snps, n_causal, n_samples, block=100, min_z=5.45):
+    """ Simulate an LD matrix and z-scores with genome-wide significant causal SNPs (|z| >= min_z).
+
+    Genotypes are correlated within blocks of SNPs, so LD is high nearby and absent between blocks.
+    Returns the z-scores, the LD matrix and the causal SNPs.
+    """
+    genotypes = rng.standard_normal((max(2000, 2 * n_snps), n_snps))
+    for start in range(0, n_snps, block):
+        genotypes[:, start:start + block] += 0.3 * np.cumsum(genotypes[:, start:start + block], axis=1)
+    ld = np.corrcoef(genotypes.T)
+    while True:
+        causal = rng.choice(n_snps, n_causal, replace=False)
+        beta = np.zeros(n_snps)
+        beta[causal] = rng.choice([-1, 1], n_causal) * rng.uniform(0.08, 0.15, n_causal)
+        z = ld @ beta * math.sqrt(n_samples) + rng.multivariate_normal(np.zeros(n_snps), ld, method='eigh')
+        if np.abs(z[causal]).min() >= min_z:
+            return z, ld, causal